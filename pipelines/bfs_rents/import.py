@@ -296,7 +296,7 @@ def main():
         "apikey": lamap_key,
         "Authorization": f"Bearer {lamap_key}",
         "Content-Type": "application/json",
-        "Prefer": "resolution=merge-duplicates",
+        "Prefer": "resolution=merge-duplicates,return=minimal",
     }
     if lamap_schema and lamap_schema != "public":
         headers["Content-Profile"] = lamap_schema
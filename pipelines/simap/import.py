@@ -22,22 +22,30 @@ Environment variables:
     LAMAP_SUPABASE_URL          - Lamap Supabase project URL (required)
     LAMAP_SUPABASE_SERVICE_KEY  - service_role key (required)
     LAMAP_SCHEMA                - target schema (default: bronze)
+    LAMAP_DIRECT_DSN            - direct Postgres DSN (optional; enables the
+                                  COPY bulk-upsert path for large runs)
 """
 
 import os
 import sys
 import re
-import json
+import functools
 import time
 import html
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
+from urllib3.util.retry import Retry
 
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
-from shared.supabase_client import batch_upsert
+from shared.pg_copy_upsert import bulk_upsert
 from shared.freshness import update_dataset_meta
+from shared.rate_limit import RateLimiter
 
 # ──────────────────────────────────────────────────────────────
 # Config
@@ -56,7 +64,38 @@ USER_AGENT = (
 )
 
 MAX_RETRIES = 5
-RETRY_BACKOFF = 2  # seconds
+RETRY_BACKOFF = 2  # seconds: 2, 4, 8, 16, 30 (capped)
+RETRY_MAX_WAIT = 30
+
+# Publication details are fetched concurrently; this bounds the number of
+# in-flight requests to simap.ch, and the limiter caps how many start per
+# second across all workers (replaces the old 0.3s sleep per project;
+# SIMAP_MAX_RATE overrides, 0 = unpaced).
+DETAIL_WORKERS = 8
+_DETAIL_RATE = RateLimiter(float(os.environ.get("SIMAP_MAX_RATE", "5")))
+PROGRESS_EVERY = 100  # log a progress line every N completed projects
+
+# One keep-alive connection pool for simap.ch and Supabase, shared by the
+# detail workers.  The adapter retries 429/5xx responses (honouring
+# Retry-After); connection errors and timeouts are retried by _get().
+_RETRY = Retry(
+    total=MAX_RETRIES,
+    connect=0,
+    read=0,
+    backoff_factor=1,
+    status_forcelist=(429, 500, 502, 503, 504),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=_RETRY))
+_SESSION.headers.update({"User-Agent": USER_AGENT})
+
+# Precompiled patterns for the per-record text helpers below
+_WS_RE = re.compile(r"\s+")
+_DOT_RE = re.compile(r"(\.\s*)+")
+# Something that looks like a tag: a bare "<" ("a<b", "< 5 ans") is text
+_TAG_RE = re.compile(r"<[A-Za-z/!][^>]*>")
 
 
 # ──────────────────────────────────────────────────────────────
@@ -69,13 +108,31 @@ def any_value(obj):
     if not obj or not isinstance(obj, dict):
         return None
     if obj.get("fr"):
-        return re.sub(r"\s+", " ", obj["fr"]).strip()
+        return _WS_RE.sub(" ", obj["fr"]).strip()
     for v in obj.values():
         if v:
-            return re.sub(r"\s+", " ", str(v)).strip()
+            return _WS_RE.sub(" ", str(v)).strip()
     return None
 
 
+@functools.lru_cache(maxsize=8192)
+def _any_value_items(items):
+    return any_value(dict(items))
+
+
+def any_value_cached(obj):
+    """any_value() memoised for small, highly repeated translation dicts
+    (CPV labels, city names).  Keyed on the ordered items, since the
+    fallback depends on key order."""
+    if not obj or not isinstance(obj, dict):
+        return None
+    try:
+        return _any_value_items(tuple(obj.items()))
+    except TypeError:  # unhashable nested value
+        return any_value(obj)
+
+
+@functools.lru_cache(maxsize=1024)
 def replace_underscore(s):
     return s.replace("_", " ") if s else None
 
@@ -83,38 +140,61 @@ def replace_underscore(s):
 def format_order_address(a):
     if not a:
         return None
-    parts = [a.get("postalCode"), any_value(a.get("city")), a.get("cantonId"), a.get("countryId")]
+    parts = [a.get("postalCode"), any_value_cached(a.get("city")), a.get("cantonId"), a.get("countryId")]
     return ", ".join(str(p) for p in parts if p) or None
 
 
+@functools.lru_cache(maxsize=8192)
+def _format_address_parts(parts):
+    return ", ".join(str(p).strip() for p in parts if p) or None
+
+
 def format_other_address(a):
     if not a:
         return None
-    parts = [a.get("street"), a.get("postalCode"), a.get("city"), a.get("cantonId"), a.get("countryId")]
-    return ", ".join(str(p).strip() for p in parts if p) or None
+    parts = (a.get("street"), a.get("postalCode"), a.get("city"), a.get("cantonId"), a.get("countryId"))
+    try:
+        return _format_address_parts(parts)
+    except TypeError:  # unhashable part
+        return _format_address_parts.__wrapped__(parts)
 
 
 def strip_html(html_str):
-    """Strip HTML tags and normalise whitespace. Mirrors stripHtmlWithRegex()."""
+    """Strip HTML tags and normalise whitespace. Mirrors stripHtmlWithRegex().
+
+    Text nodes are joined with ". " (what the JS regex produced by replacing
+    every tag); entities are decoded by the parser.  Strings without any
+    tag skip the parser entirely, so a stray "<" is kept as text, as the
+    JS regex kept it.
+    """
     if not html_str:
         return None
-    text = re.sub(r"<[^>]*>", ". ", html_str)
-    text = text.replace("&nbsp;", " ")
-    text = html.unescape(text)
-    text = re.sub(r"\s+", " ", text).strip()
+    if _TAG_RE.search(html_str):
+        text = LexborHTMLParser(html_str).text(separator=". ")
+    else:
+        text = html.unescape(html_str)
+    text = _WS_RE.sub(" ", text).strip()
     # Clean up artefact from splitting on tags
-    text = re.sub(r"(\.\s*)+", ". ", text).strip(". ")
+    text = _DOT_RE.sub(". ", text).strip(". ")
     return text or None
 
 
+@functools.lru_cache(maxsize=4096)
+def _fmt_dt(s):
+    """Parse + format one ISO-8601 string (deadlines repeat across records)."""
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    return datetime.fromisoformat(s).strftime("%Y-%m-%d, %H:%M")
+
+
 def format_datetime(s):
     """If ISO-8601 datetime, format as YYYY-MM-DD, HH:mm. Otherwise return as-is."""
-    if not s:
+    # Cheap reject for anything that can't be an ISO date (YYYY-MM-DD...)
+    if not s or not isinstance(s, str) or len(s) < 10 or not s[0].isdigit():
         return s
     try:
-        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
-        return dt.strftime("%Y-%m-%d, %H:%M")
-    except (ValueError, TypeError):
+        return _fmt_dt(s)
+    except ValueError:
         return s
 
 
@@ -129,7 +209,7 @@ def format_proc_address(item):
     parts = [
         any_value(item.get("street")),
         item.get("postalCode"),
-        any_value(item.get("city")),
+        any_value_cached(item.get("city")),
         item.get("cantonId"),
         item.get("countryId"),
     ]
@@ -178,24 +258,31 @@ def format_vendors(vendor_list):
 # API calls
 # ──────────────────────────────────────────────────────────────
 
-def _get(url, headers=None, retry=0):
-    """GET with retry logic. Mirrors JS get()."""
-    try:
-        r = requests.get(url, headers=headers or {}, timeout=60)
-        r.raise_for_status()
-        return r
-    except Exception as e:
-        if retry >= MAX_RETRIES:
+def _get(url, headers=None):
+    """GET with retry logic. Mirrors JS get().
+
+    HTTP status errors are final here: retryable statuses were already
+    retried by the session adapter.  Network errors (connection reset,
+    timeout) are retried with capped exponential backoff.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            r = _SESSION.get(url, headers=headers, timeout=60)
+            r.raise_for_status()
+            return r
+        except requests.HTTPError:
             raise
-        wait = RETRY_BACKOFF ** (retry + 1)
-        print(f"    Request error ({e}), retrying in {wait}s (attempt {retry + 1}/{MAX_RETRIES})")
-        time.sleep(wait)
-        return _get(url, headers=headers, retry=retry + 1)
+        except requests.RequestException as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            wait = min(RETRY_BACKOFF * 2 ** attempt, RETRY_MAX_WAIT)
+            print(f"    Request error ({e}), retrying in {wait}s (attempt {attempt + 1}/{MAX_RETRIES})")
+            time.sleep(wait)
 
 
 def get_cookies():
     """Hit the Simap homepage to get a session cookie."""
-    r = _get(COOKIE_URL, headers={"User-Agent": USER_AGENT})
+    r = _get(COOKIE_URL)
     cookies = r.headers.get("set-cookie", "")
     # requests may return multiple set-cookie values joined
     return cookies
@@ -209,10 +296,7 @@ def search_projects(session_cookies):
     one_month_ago = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m-%d")
     url = f"{SEARCH_URL}?orderAddressCountryOnlySwitzerland=false&newestPublicationFrom={one_month_ago}"
 
-    headers = {
-        "User-Agent": USER_AGENT,
-        "Cookie": session_cookies,
-    }
+    headers = {"Cookie": session_cookies}
 
     r = _get(url, headers=headers)
     data = r.json()
@@ -222,6 +306,7 @@ def search_projects(session_cookies):
 def get_publication_details(project_id, publication_id):
     """Fetch full publication details for one project. Mirrors getRecordData()."""
     url = DETAIL_URL.format(project_id=project_id, publication_id=publication_id)
+    _DETAIL_RATE.wait()
     r = _get(url)
     return r.json()
 
@@ -230,41 +315,68 @@ def get_publication_details(project_id, publication_id):
 # Parse — exact port of formatData() from simap.js
 # ──────────────────────────────────────────────────────────────
 
+def _html_text(obj):
+    return strip_html(any_value(obj))
+
+
+def _true_or_none(v):
+    return v or None
+
+
+# Uniform fields: (column, path into the raw JSON, transform or None).
+# A missing path leaves the column unset, which serialise_record() treats
+# the same as None.  Fields that combine several inputs are handled in
+# parse_publication() itself.
+_FIELD_MAP = (
+    # ── base ──
+    ("project_number", ("base", "projectNumber"), None),
+    ("title", ("base", "title"), any_value),
+    ("publication_number", ("base", "publicationNumber"), None),
+    ("publication_date", ("base", "publicationDate"), None),
+    ("type", ("base", "type"), replace_underscore),
+    ("contract_type", ("base", "orderType"), None),
+    # ── decision ──
+    ("total_price_selection", ("decision", "totalPriceSelection"), replace_underscore),
+    ("number_of_submissions", ("decision", "numberOfSubmissions"), None),
+    ("award_decision_date", ("decision", "awardDecisionDate"), None),
+    # ── procurement ──
+    ("order_address", ("procurement", "orderAddress"), format_order_address),
+    ("no_postal", ("procurement", "orderAddress", "postalCode"), None),
+    ("order_description", ("procurement", "orderDescription"), _html_text),
+    ("can_contract_be_extended", ("procurement", "canContractBeExtended"), _true_or_none),
+    # ── dates ──
+    ("offer_deadline", ("dates", "offerDeadline"), format_datetime),
+    # ── project-info ──
+    ("procurement_office", ("project-info", "procOfficeAddress"), format_proc_address),
+    ("procurement_recipient", ("project-info", "procurementRecipientAddress"), format_proc_address),
+)
+
+
 def parse_publication(raw):
     """
     Transform raw publication-detail JSON into a flat dict matching the
     bronze."Simap" column structure.  Mirrors formatData() from simap.js.
     """
-    base = raw.get("base") or {}
+    pd = {}
+
+    for dst, path, fn in _FIELD_MAP:
+        v = raw
+        for p in path:
+            v = v.get(p) if isinstance(v, dict) else None
+        if v is not None:
+            pd[dst] = fn(v) if fn else v
+
     decision = raw.get("decision") or {}
     procurement = raw.get("procurement") or {}
-    project_info = raw.get("project-info") or {}
     dates = raw.get("dates") or {}
 
-    pd = {}
-
-    # ── base ──
-    pd["project_number"] = base.get("projectNumber")
-    pd["title"] = any_value(base.get("title"))
-    pd["publication_number"] = base.get("publicationNumber")
-    pd["publication_date"] = base.get("publicationDate")
-    pd["type"] = replace_underscore(base.get("type"))
-    pd["contract_type"] = base.get("orderType")
-
     # ── decision ──
     if decision:
         pd["vendors"] = format_vendors(decision.get("vendors"))
-        pd["total_price_selection"] = replace_underscore(decision.get("totalPriceSelection"))
-        pd["number_of_submissions"] = decision.get("numberOfSubmissions")
-        pd["award_decision_date"] = decision.get("awardDecisionDate")
 
     # ── procurement ──
     if procurement:
-        oa = procurement.get("orderAddress") or {}
-        pd["order_address"] = format_order_address(oa)
-        pd["no_postal"] = oa.get("postalCode")
-
-        canton = oa.get("cantonId")
+        canton = (procurement.get("orderAddress") or {}).get("cantonId")
         pd["canton"] = canton if canton and canton != "CH" else None
 
         contract_type = procurement.get("orderType")
@@ -275,8 +387,6 @@ def parse_publication(raw):
         if not pd.get("contract_type"):
             pd["contract_type"] = contract_type
 
-        pd["order_description"] = strip_html(any_value(procurement.get("orderDescription")))
-
         contract_period = (procurement.get("contractPeriod") or {}).get("dateRange")
         contract_days = procurement.get("contractDays")
         if contract_period and isinstance(contract_period, list):
@@ -284,23 +394,20 @@ def parse_publication(raw):
         elif contract_days:
             pd["contract_duration"] = f"{contract_days} days"
 
-        pd["can_contract_be_extended"] = procurement.get("canContractBeExtended") or None
-
         # CPV codes
         cpv = []
         cpv_code = procurement.get("cpvCode")
         if cpv_code:
-            cpv.append({"code": cpv_code.get("code"), "text": any_value(cpv_code.get("label"))})
+            cpv.append({"code": cpv_code.get("code"), "text": any_value_cached(cpv_code.get("label"))})
         additional = procurement.get("additionalCpvCodes") or []
         for c in additional:
-            cpv.append({"code": c.get("code"), "text": any_value(c.get("label"))})
+            cpv.append({"code": c.get("code"), "text": any_value_cached(c.get("label"))})
         pd["cpv"] = cpv
 
         pd["type_of_contract_type"] = replace_underscore(type_of_contract_type)
 
     # ── dates ──
     if dates:
-        pd["offer_deadline"] = format_datetime(dates.get("offerDeadline"))
         validity_date = dates.get("offerValidityDeadlineDate")
         validity_days = dates.get("offerValidityDeadlineDays")
         if validity_date:
@@ -308,11 +415,6 @@ def parse_publication(raw):
         elif validity_days:
             pd["offer_validity_deadline"] = f"{validity_days} days"
 
-    # ── project-info ──
-    if project_info:
-        pd["procurement_office"] = format_proc_address(project_info.get("procOfficeAddress"))
-        pd["procurement_recipient"] = format_proc_address(project_info.get("procurementRecipientAddress"))
-
     return pd
 
 
@@ -320,6 +422,11 @@ def parse_publication(raw):
 # Serialise JSON columns for PostgREST upsert
 # ──────────────────────────────────────────────────────────────
 
+# Columns holding nested data; parse_publication() always emits a list/dict
+# (or None) for these, so no per-value type check is needed.
+_JSON_COLS = frozenset(("cpv", "vendors", "procurement_office", "procurement_recipient"))
+
+
 def serialise_record(record):
     """
     Convert Python dicts/lists in JSON columns to JSON strings,
@@ -330,16 +437,11 @@ def serialise_record(record):
     for k, v in record.items():
         if v is None:
             continue  # let DB default/null apply
-        if k in ("cpv", "vendors", "procurement_office", "procurement_recipient"):
-            if isinstance(v, (list, dict)):
-                # Empty list/dict → null
-                if not v:
-                    continue
-                out[k] = json.dumps(v)
-            else:
-                out[k] = v
-        else:
-            out[k] = v
+        if k in _JSON_COLS:
+            if not v:
+                continue  # Empty list/dict → null
+            v = orjson.dumps(v).decode()
+        out[k] = v
     return out
 
 
@@ -358,7 +460,7 @@ def get_row_count(url, key, schema, table):
     if schema and schema != "public":
         headers["Accept-Profile"] = schema
     try:
-        r = requests.head(endpoint, headers=headers, timeout=15)
+        r = _SESSION.head(endpoint, headers=headers, timeout=15)
         # Count is in the content-range header: "0-N/TOTAL"
         cr = r.headers.get("content-range", "")
         if "/" in cr:
@@ -368,6 +470,27 @@ def get_row_count(url, key, schema, table):
     return None
 
 
+# ──────────────────────────────────────────────────────────────
+# Per-project worker
+# ──────────────────────────────────────────────────────────────
+
+def fetch_record(proj):
+    """Fetch + parse one search hit into a serialised record.
+    Returns None for records without a unique key. Runs in a worker thread."""
+    project_id = proj["id"]
+    raw = get_publication_details(project_id, proj["publicationId"])
+    parsed = parse_publication(raw)
+
+    # Add the URL field (same as JS version)
+    parsed["url"] = f"https://www.simap.ch/en/project-detail/{project_id}"
+
+    # Skip records without a unique key
+    if not parsed.get("project_number") or not parsed.get("publication_number"):
+        return None
+
+    return serialise_record(parsed)
+
+
 # ──────────────────────────────────────────────────────────────
 # Main
 # ──────────────────────────────────────────────────────────────
@@ -376,6 +499,7 @@ def main():
     url = os.environ.get("LAMAP_SUPABASE_URL", "")
     key = os.environ.get("LAMAP_SUPABASE_SERVICE_KEY", "")
     schema = os.environ.get("LAMAP_SCHEMA", "bronze")
+    dsn = os.environ.get("LAMAP_DIRECT_DSN", "")
 
     if not url or not key:
         print("ERROR: LAMAP_SUPABASE_URL and LAMAP_SUPABASE_SERVICE_KEY are required")
@@ -403,43 +527,37 @@ def main():
         print("  No projects found. Exiting.")
         return
 
-    # ── Step 3: Fetch details + parse for each project ──
+    # ── Step 3: Fetch details + parse for each project (concurrently) ──
     records = []
     errors = 0
 
-    for i, proj in enumerate(projects):
-        project_id = proj.get("id")
-        publication_id = proj.get("publicationId")
-
-        if not project_id or not publication_id:
-            continue
-
-        if (i + 1) % 100 == 0 or i == 0:
-            print(f"  Fetching details: {i + 1}/{len(projects)}...")
-
-        try:
-            raw = get_publication_details(project_id, publication_id)
-            parsed = parse_publication(raw)
-
-            # Add the URL field (same as JS version)
-            parsed["url"] = f"https://www.simap.ch/en/project-detail/{project_id}"
-
-            # Skip records without a unique key
-            if not parsed.get("project_number") or not parsed.get("publication_number"):
+    jobs = [p for p in projects if p.get("id") and p.get("publicationId")]
+    print(f"  Fetching details for {len(jobs)} projects ({DETAIL_WORKERS} workers)...")
+
+    done = 0
+    next_report = 1  # first completion, then every PROGRESS_EVERY
+
+    with ThreadPoolExecutor(max_workers=DETAIL_WORKERS) as pool:
+        futures = {pool.submit(fetch_record, proj): proj for proj in jobs}
+
+        for future in as_completed(futures):
+            done += 1
+            if done >= next_report:
+                print(f"  Fetching details: {done}/{len(jobs)}...")
+                next_report = (done // PROGRESS_EVERY + 1) * PROGRESS_EVERY
+
+            try:
+                record = future.result()
+            except Exception as e:
+                errors += 1
+                if errors <= 5:
+                    print(f"    Error on project {futures[future].get('id')}: {e}")
+                elif errors == 6:
+                    print("    (suppressing further error messages)")
                 continue
 
-            record = serialise_record(parsed)
-            records.append(record)
-
-        except Exception as e:
-            errors += 1
-            if errors <= 5:
-                print(f"    Error on project {project_id}: {e}")
-            elif errors == 6:
-                print("    (suppressing further error messages)")
-
-        # Rate limiting — be respectful to simap.ch
-        time.sleep(0.3)
+            if record is not None:
+                records.append(record)
 
     print(f"\n  Parsed: {len(records)} records ({errors} errors)")
 
@@ -447,16 +565,24 @@ def main():
         print("  No records to upsert. Exiting.")
         return
 
+    # serialise_record() drops None values, so key sets vary per record.
+    # PostgREST wants identical keys across a batch: give every record the
+    # same keys, in the same order, from one None-filled template.
+    common_keys = sorted(set().union(*(r.keys() for r in records)))
+    tmpl = dict.fromkeys(common_keys)
+    records = [{**tmpl, **r} for r in records]
+
     # ── Step 4: Upsert to lamap_db ──
     print(f"\n  Upserting to {schema}.{TABLE_NAME}...")
-    upserted = batch_upsert(
+    upserted = bulk_upsert(
         url=url,
         key=key,
         table=TABLE_NAME,
         records=records,
         conflict_column=CONFLICT_COLUMNS,
         schema=schema,
-        batch_size=200,
+        batch_size=1000,
+        dsn=dsn,
     )
 
     # ── Safety: count rows AFTER import ──
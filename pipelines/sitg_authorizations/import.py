@@ -20,20 +20,30 @@ Environment variables:
     RE_LLM_SUPABASE_URL              - re-LLM Supabase project URL (required)
     RE_LLM_SUPABASE_SERVICE_ROLE_KEY - service_role key            (required)
     RE_LLM_SCHEMA                    - target schema               (default: bronze_ch)
+    RE_LLM_DIRECT_DSN                - direct Postgres DSN         (optional, COPY path)
     YOONEET_SUPABASE_URL             - Yooneet Supabase project URL (optional)
     YOONEET_SUPABASE_SERVICE_KEY     - service_role key             (optional)
     YOONEET_SCHEMA                   - target schema                (default: bronze)
+    YOONEET_DIRECT_DSN               - direct Postgres DSN          (optional, COPY path)
+    ASSUME_GEOMETRY_COLUMN           - 1 = skip the geometry-column probe (optional;
+                                       re-run once without it after a schema change)
 """
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+import orjson
 
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
-from shared.supabase_client import batch_upsert
-from shared.sitg_arcgis import fetch_all_features
+from shared.log_prefix import log, log_prefix
+from shared.pg_copy_upsert import bulk_upsert
+from shared.postgrest_meta import (
+    ASSUME_GEOMETRY_COLUMN, get_column_format, get_row_count, get_table_columns, has_column,
+)
+from shared.sitg_arcgis import esri_to_ewkb_hex, iter_features
+from shared.supabase_client import dedupe_records
 
 # ──────────────────────────────────────────────────────────────
 # Dataset configs
@@ -50,6 +60,8 @@ DATASETS = [
         "source": "arcgis",
         "url": "https://vector.sitg.ge.ch/arcgis/rest/services/Hosted/sit_autor_dossier/FeatureServer/0",
         "conflict_column": "objectid",
+        # Mostly re-loads unchanged rows: MERGE skips no-op updates (COPY path only)
+        "upsert_mode": "merge",
     },
     {
         "name": "Autorisations objets",
@@ -59,6 +71,7 @@ DATASETS = [
         "source": "arcgis",
         "url": "https://vector.sitg.ge.ch/arcgis/rest/services/Hosted/sit_autor_objet/FeatureServer/0",
         "conflict_column": "objectid",
+        "upsert_mode": "merge",
     },
 ]
 
@@ -70,202 +83,255 @@ EXCLUDE_FIELDS = {"iteration"}
 # Helpers
 # ──────────────────────────────────────────────────────────────
 
-def get_row_count(url: str, key: str, schema: str, table: str) -> int | None:
-    """Get current row count via PostgREST HEAD request."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select=count"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-        "Prefer": "count=exact",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.head(endpoint, headers=headers, timeout=30)
-        cr = r.headers.get("content-range", "")
-        if "/" in cr:
-            return int(cr.split("/")[1])
-    except Exception as e:
-        print(f"  Warning: could not get row count: {e}")
-    return None
-
-
-def has_column(url: str, key: str, schema: str, table: str, column: str) -> bool:
-    """Check if a column exists in the target table via PostgREST."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select={column}&limit=0"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.get(endpoint, headers=headers, timeout=10)
-        return r.status_code == 200
-    except Exception:
-        return False
+def project_records(
+    records: list[dict],
+    renames: dict[str, str],
+    allowed: frozenset[str] | None,
+    drop: frozenset[str],
+) -> list[dict]:
+    """Rename, exclude and column-filter records in a single pass.
 
+    Each output dict is built exactly once; the input records are never
+    mutated (the same page is shared by every destination).
 
-def get_table_columns(url: str, key: str, schema: str, table: str) -> set[str]:
-    """Discover existing columns in a table via PostgREST."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?limit=1"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.get(endpoint, headers=headers, timeout=15)
-        if r.status_code == 200:
-            rows = r.json()
-            if rows:
-                return set(rows[0].keys())
-    except Exception as e:
-        print(f"  Warning: could not discover table columns: {e}")
-    return set()
-
-
-def apply_field_renames(records: list[dict], renames: dict[str, str]) -> list[dict]:
-    """Rename fields in all records according to the mapping."""
-    if not renames:
-        return records
-    for r in records:
-        for old_name, new_name in renames.items():
-            if old_name in r:
-                r[new_name] = r.pop(old_name)
-    return records
+    `allowed` is the set of target table columns (already minus `drop`),
+    or None when they could not be discovered (keep everything).  Keys in
+    `drop` are removed either way.
+    """
+    if not records:
+        return []
 
+    # ArcGIS pages share one schema: only keep renames the page actually has
+    present = {old: new for old, new in renames.items() if old in records[0]}
 
-def filter_to_known_columns(
-    records: list[dict], known_columns: set[str], exclude: set[str]
-) -> list[dict]:
-    """Keep only columns that exist in the target table, minus excluded."""
-    if not known_columns:
-        for r in records:
-            for f in exclude:
-                r.pop(f, None)
-        return records
+    if not present:
+        if allowed is None:
+            return [{k: v for k, v in r.items() if k not in drop} for r in records]
+        return [{k: v for k, v in r.items() if k in allowed} for r in records]
 
-    allowed = known_columns - exclude
-    return [{k: v for k, v in r.items() if k in allowed} for r in records]
+    out: list[dict] = []
+    for r in records:
+        d = {}
+        for k, v in r.items():
+            k = present.get(k, k)
+            if k in drop or (allowed is not None and k not in allowed):
+                continue
+            d[k] = v
+        out.append(d)
+    return out
 
 
 # ──────────────────────────────────────────────────────────────
-# Process a single destination
+# Per-destination streaming upsert
 # ──────────────────────────────────────────────────────────────
 
-def process_destination(
-    dest_name: str,
-    dest_url: str,
-    dest_key: str,
-    dest_schema: str,
-    datasets_with_records: list[tuple[dict, list[dict]]],
-    table_field: str = "table",
-) -> bool:
-    """Upsert all datasets into one destination. Returns True if all succeeded.
-
-    `table_field` picks which key in each dataset dict holds the destination
-    table name. Default "table" preserves the lamap_db / Yooneet code path.
-    Pass "rellm_table" to route into re-LLM's snake_case names.
+def open_destination(dest: dict, ds: dict) -> dict:
+    """Prepare one dataset → destination sink before its first page.
+
+    Discovers the table columns and snapshots the row count once; the
+    returned state dict is then fed page by page to upsert_page() and
+    finalised by close_destination().
+
+    `dest["table_field"]` picks which key in the dataset dict holds the
+    destination table name ("rellm_table" for re-LLM's snake_case names,
+    "table" for the lamap_db / Yooneet names).
     """
-    print(f"\n{'=' * 60}")
-    print(f"  Destination: {dest_name} ({dest_schema})")
-    print(f"{'=' * 60}")
-
-    all_ok = True
-
-    for ds, records in datasets_with_records:
-        table = ds[table_field]
-        conflict = ds["conflict_column"]
-        renames = ds.get("field_renames", {})
-
-        print(f"\n{'━' * 60}")
-        print(f"  [{ds['name']}] → {dest_schema}.{table}")
-        print(f"  Records fetched: {len(records):,}")
-        print(f"{'━' * 60}")
-
-        if not records:
-            print("  No records. Skipping.")
-            continue
-
-        # Make a copy so renames/filtering don't affect other destinations
-        work_records = [dict(r) for r in records]
-
-        # Apply field renames
-        work_records = apply_field_renames(work_records, renames)
-
-        # Remove excluded fields
-        for r in work_records:
-            for f in EXCLUDE_FIELDS:
-                r.pop(f, None)
-
-        # Discover table columns and filter out unknown ones
-        known_cols = get_table_columns(dest_url, dest_key, dest_schema, table)
-        if known_cols:
-            before_keys = set()
-            for r in work_records[:1]:
-                before_keys = set(r.keys())
-            work_records = filter_to_known_columns(work_records, known_cols, EXCLUDE_FIELDS)
-            after_keys = set()
-            for r in work_records[:1]:
-                after_keys = set(r.keys())
-            dropped = before_keys - after_keys
-            if dropped:
-                print(f"  Dropped unknown columns: {', '.join(sorted(dropped))}")
-
-        # Check geometry column
-        geom_exists = has_column(dest_url, dest_key, dest_schema, table, "geometry")
-        if geom_exists and any("geometry" in r for r in work_records[:1]):
-            print("  Geometry: included")
-        else:
-            work_records = [{k: v for k, v in r.items() if k != "geometry"} for r in work_records]
-            print("  Geometry: column not found in table, stripping")
-
-        # Normalise keys: PostgREST requires all objects in a batch to have
-        # identical keys.  Some ArcGIS features may lack optional fields
-        # (e.g. geometry on features with NULL shape).
-        all_keys = set()
-        for r in work_records:
-            all_keys |= r.keys()
-        for r in work_records:
-            for k in all_keys:
-                r.setdefault(k, None)
-
-        # Row count BEFORE
-        rows_before = get_row_count(dest_url, dest_key, dest_schema, table)
-        print(f"  Rows before: {rows_before or 'unknown'}")
-
-        # Upsert
-        upserted = batch_upsert(
-            url=dest_url,
-            key=dest_key,
-            table=table,
-            records=work_records,
-            conflict_column=conflict,
-            schema=dest_schema,
-            batch_size=500,
+    table = ds[dest["table_field"]]
+
+    log(f"\n{'━' * 60}")
+    log(f"  [{ds['name']}] → {dest['name']} {dest['schema']}.{table}")
+    log(f"{'━' * 60}")
+
+    known_cols = get_table_columns(dest["url"], dest["key"], dest["schema"], table)
+
+    # Check geometry column — answered from the discovered columns when
+    # possible; only an empty/unreadable table needs the extra probe.
+    if known_cols:
+        geom_exists = "geometry" in known_cols
+    else:
+        geom_exists = ASSUME_GEOMETRY_COLUMN or has_column(
+            dest["url"], dest["key"], dest["schema"], table, "geometry"
         )
+    # PostGIS columns get compact EWKB; text/jsonb columns keep EsriJSON
+    geom_ewkb = geom_exists and "geometry" in get_column_format(
+        dest["url"], dest["key"], dest["schema"], table, "geometry"
+    )
+    if geom_exists:
+        log(f"  Geometry: included ({'EWKB' if geom_ewkb else 'EsriJSON'})")
+    else:
+        log("  Geometry: column not found in table, stripping")
+
+    # Projection sets, computed once per destination instead of per page
+    drop = frozenset(EXCLUDE_FIELDS if geom_exists else EXCLUDE_FIELDS | {"geometry"})
+    allowed = frozenset(known_cols - drop) if known_cols else None
+
+    rows_before = get_row_count(dest["url"], dest["key"], dest["schema"], table)
+    log(f"  Rows before: {rows_before or 'unknown'}")
+
+    return {
+        "dest": dest,
+        "table": table,
+        "known_cols": known_cols,
+        "allowed": allowed,
+        "geom_ewkb": geom_ewkb,
+        "drop": drop,
+        "rows_before": rows_before,
+        "fetched": 0,
+        "upserted": 0,
+        "failed_pages": 0,
+    }
+
 
-        # Row count AFTER
-        rows_after = get_row_count(dest_url, dest_key, dest_schema, table)
+def upsert_page(state: dict, ds: dict, records: list[dict]) -> None:
+    """Transform one page of ArcGIS records for this destination and upsert it."""
+    dest = state["dest"]
+    known_cols = state["known_cols"]
+    renames = ds.get("field_renames", {})
+
+    if state["fetched"] == 0 and known_cols and records:
+        dropped = {renames.get(k, k) for k in records[0]} - known_cols - EXCLUDE_FIELDS
+        if dropped:
+            log(f"  [{dest['name']}] Dropped unknown columns: {', '.join(sorted(dropped))}")
+    state["fetched"] += len(records)
+
+    # Rename + exclude + column filter + geometry strip, one dict per record
+    work_records = project_records(records, renames, state["allowed"], state["drop"])
+
+    # Pages carry the parsed EsriJSON geometry (raw_geometry=True): encode
+    # it straight to EWKB for PostGIS columns, or to JSON text otherwise
+    encode = esri_to_ewkb_hex if state["geom_ewkb"] else lambda g: orjson.dumps(g).decode()
+    for r in work_records:
+        if r.get("geometry"):
+            r["geometry"] = encode(r["geometry"])
+
+    # Dedupe here rather than leave it to bulk_upsert, so the row count it
+    # returns is comparable to len(work_records) below
+    work_records = dedupe_records(work_records, ds["conflict_column"])
+
+    # Normalise keys: PostgREST requires all objects in a batch to have
+    # identical keys.  Some ArcGIS features may lack optional fields
+    # (e.g. geometry on features with NULL shape).  One None-filled template
+    # merged under each record gives every dict the same keys in the same order.
+    all_keys = set()
+    for r in work_records:
+        all_keys |= r.keys()
+    tmpl = dict.fromkeys(sorted(all_keys))
+    work_records = [{**tmpl, **r} for r in work_records]
+
+    upserted = bulk_upsert(
+        url=dest["url"],
+        key=dest["key"],
+        table=state["table"],
+        records=work_records,
+        conflict_column=ds["conflict_column"],
+        schema=dest["schema"],
+        batch_size=1000,
+        dsn=dest["dsn"],
+        mode=ds.get("upsert_mode", "upsert"),
+    )
+    state["upserted"] += upserted
+    if upserted < len(work_records):
+        state["failed_pages"] += 1
 
-        print(f"\n  Results:")
-        print(f"    Upserted:     {upserted:,}")
-        print(f"    Rows before:  {rows_before or 'unknown'}")
-        print(f"    Rows after:   {rows_after or 'unknown'}")
 
-        if rows_before is not None and rows_after is not None:
-            delta = rows_after - rows_before
-            print(f"    Net new:      {delta:,}")
-            if rows_after < rows_before:
-                print("    WARNING: Row count DECREASED!")
+def close_destination(state: dict, ds: dict, fetch_error: Exception | None = None) -> bool:
+    """Print the results for one dataset → destination. Returns True on success.
 
-        if upserted == 0:
-            print("    ERROR: Zero rows upserted!")
-            all_ok = False
+    A fetch that broke off mid-stream, or any page that didn't fully
+    upsert, makes it a partial load: reported and returned as a failure.
+    """
+    dest = state["dest"]
+    upserted = state["upserted"]
+    rows_before = state["rows_before"]
+    # Nothing written → nothing to re-count (the DB may well be unhealthy)
+    rows_after = (
+        get_row_count(dest["url"], dest["key"], dest["schema"], state["table"])
+        if upserted else rows_before
+    )
 
-    return all_ok
+    log(f"\n  Results: [{ds['name']}] → {dest['name']} {dest['schema']}.{state['table']}")
+    log(f"    Fetched:      {state['fetched']:,}")
+    log(f"    Upserted:     {upserted:,}")
+    log(f"    Rows before:  {rows_before or 'unknown'}")
+    log(f"    Rows after:   {rows_after or 'unknown'}")
+
+    if rows_before is not None and rows_after is not None:
+        delta = rows_after - rows_before
+        log(f"    Net new:      {delta:,}")
+        if rows_after < rows_before:
+            log("    WARNING: Row count DECREASED!")
+
+    if upserted == 0:
+        log("    ERROR: Zero rows upserted!")
+        return False
+    if fetch_error is not None:
+        log(f"    ERROR: PARTIAL load — fetch failed after {state['fetched']:,} records")
+        return False
+    if state["failed_pages"]:
+        log(f"    ERROR: PARTIAL load — {state['failed_pages']} page(s) not fully upserted")
+        return False
+    return True
+
+
+# ──────────────────────────────────────────────────────────────
+# Process a single dataset
+# ──────────────────────────────────────────────────────────────
+
+def process_dataset(ds: dict, destinations: list[dict]) -> dict[str, bool]:
+    """Stream one dataset from ArcGIS into every destination.
+
+    Each ArcGIS page is upserted to all destinations as soon as it arrives,
+    so only one page of records is held in memory at a time.
+
+    Fetch errors and upsert errors are caught (and labelled) separately; a
+    page that fails on one destination doesn't stop the stream, but marks
+    that destination's load as partial.
+
+    Returns {destination name: ok}.
+    """
+    log(f"\n{'━' * 60}")
+    log(f"  Fetching: {ds['name']}")
+    log(f"  URL:      {ds['url'][:80]}...")
+    log(f"{'━' * 60}")
+
+    ok = {dest["name"]: True for dest in destinations}
+    states: list[dict] | None = None
+    fetch_error = None
+    pages = iter_features(ds["url"], include_geometry=True, raw_geometry=True)
+    while True:
+        try:
+            page = next(pages, None)
+        except Exception as e:
+            log(f"  FETCH ERROR: {e}")
+            fetch_error = e
+            break
+        if page is None:
+            break
+
+        if states is None:
+            states = []
+            for dest in destinations:
+                try:
+                    states.append(open_destination(dest, ds))
+                except Exception as e:
+                    log(f"  [{dest['name']}] DESTINATION ERROR: {e}")
+                    ok[dest["name"]] = False
+        for state in states:
+            try:
+                upsert_page(state, ds, page)
+            except Exception as e:
+                log(f"  [{state['dest']['name']}] UPSERT ERROR: {e}")
+                state["failed_pages"] += 1
+
+    if states is None:
+        if fetch_error is not None:
+            return {name: False for name in ok}
+        log("  No records. Skipping.")
+        return ok
+
+    for state in states:
+        ok[state["dest"]["name"]] = close_destination(state, ds, fetch_error)
+    return ok
 
 
 # ──────────────────────────────────────────────────────────────
@@ -277,61 +343,62 @@ def main():
     rellm_url = os.environ.get("RE_LLM_SUPABASE_URL", "")
     rellm_key = os.environ.get("RE_LLM_SUPABASE_SERVICE_ROLE_KEY", "")
     rellm_schema = os.environ.get("RE_LLM_SCHEMA", "bronze_ch")
+    rellm_dsn = os.environ.get("RE_LLM_DIRECT_DSN", "")
 
     if not rellm_url or not rellm_key:
-        print("ERROR: RE_LLM_SUPABASE_URL and RE_LLM_SUPABASE_SERVICE_ROLE_KEY are required")
+        log("ERROR: RE_LLM_SUPABASE_URL and RE_LLM_SUPABASE_SERVICE_ROLE_KEY are required")
         sys.exit(1)
 
     # ── Optional: Yooneet ──
     yooneet_url = os.environ.get("YOONEET_SUPABASE_URL", "")
     yooneet_key = os.environ.get("YOONEET_SUPABASE_SERVICE_KEY", "")
     yooneet_schema = os.environ.get("YOONEET_SCHEMA", "bronze")
+    yooneet_dsn = os.environ.get("YOONEET_DIRECT_DSN", "")
+
+    log("=" * 60)
+    log("  SITG Authorizations Pipeline")
+    log(f"  Datasets: {len(DATASETS)}")
+    log("=" * 60)
+
+    destinations = [
+        {
+            "name": "re-LLM", "url": rellm_url, "key": rellm_key,
+            "schema": rellm_schema, "dsn": rellm_dsn, "table_field": "rellm_table",
+        },
+    ]
+    if yooneet_url and yooneet_key:
+        destinations.append({
+            "name": "yooneet", "url": yooneet_url, "key": yooneet_key,
+            "schema": yooneet_schema, "dsn": yooneet_dsn, "table_field": "table",
+        })
+    else:
+        log("\n  Yooneet: not configured, skipping")
 
-    print("=" * 60)
-    print("  SITG Authorizations Pipeline")
-    print(f"  Datasets: {len(DATASETS)}")
-    print("=" * 60)
-
-    # ── Fetch all datasets ──
-    datasets_with_records: list[tuple[dict, list[dict]]] = []
-
-    for ds in DATASETS:
-        print(f"\n{'━' * 60}")
-        print(f"  Fetching: {ds['name']}")
-        print(f"  URL:      {ds['url'][:80]}...")
-        print(f"{'━' * 60}")
-
-        try:
-            records = fetch_all_features(ds["url"], include_geometry=True)
-        except Exception as e:
-            print(f"  FETCH ERROR: {e}")
-            records = []
+    # ── Stream each dataset into all destinations (datasets in parallel) ──
+    ok = {dest["name"]: True for dest in destinations}
 
-        datasets_with_records.append((ds, records))
+    def run_dataset(ds: dict) -> dict[str, bool]:
+        # Datasets run in parallel, so their logs interleave: every line
+        # logged for this dataset (shared helpers' workers included) is
+        # prefixed with its table
+        with log_prefix(f"[{ds['table']}] "):
+            return process_dataset(ds, destinations)
 
-    # ── Upsert to re-LLM (required) ──
-    rellm_ok = process_destination(
-        "re-LLM", rellm_url, rellm_key, rellm_schema, datasets_with_records,
-        table_field="rellm_table",
-    )
+    with ThreadPoolExecutor(max_workers=len(DATASETS)) as pool:
+        for result in pool.map(run_dataset, DATASETS):
+            for name, dest_ok in result.items():
+                ok[name] = ok[name] and dest_ok
 
-    # ── Upsert to Yooneet (optional) ──
-    if yooneet_url and yooneet_key:
-        yooneet_ok = process_destination(
-            "yooneet", yooneet_url, yooneet_key, yooneet_schema, datasets_with_records
-        )
-        if not yooneet_ok:
-            print("\n  WARNING: Yooneet had failures (optional destination)")
-    else:
-        print("\n  Yooneet: not configured, skipping")
+    if not ok.get("yooneet", True):
+        log("\n  WARNING: Yooneet had failures (optional destination)")
 
     # ── Final status ──
-    print("\n" + "=" * 60)
-    print("  IMPORT COMPLETE")
-    print("=" * 60)
+    log("\n" + "=" * 60)
+    log("  IMPORT COMPLETE")
+    log("=" * 60)
 
-    if not rellm_ok:
-        print("  FAILED: re-LLM had errors")
+    if not ok["re-LLM"]:
+        log("  FAILED: re-LLM had errors")
         sys.exit(1)
 
 
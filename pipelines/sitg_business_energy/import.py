@@ -24,6 +24,8 @@ Environment variables:
     YOONEET_SUPABASE_URL        - Yooneet Supabase project URL (optional)
     YOONEET_SUPABASE_SERVICE_KEY - service_role key (optional)
     YOONEET_SCHEMA              - target schema (default: bronze)
+    ASSUME_GEOMETRY_COLUMN      - 1 = skip the geometry-column probe (optional;
+                                  re-run once without it after a schema change)
 """
 
 import os
@@ -33,6 +35,7 @@ import requests
 
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from shared.postgrest_meta import ASSUME_GEOMETRY_COLUMN
 from shared.supabase_client import batch_upsert
 from shared.sitg_arcgis import fetch_all_features
 
@@ -218,7 +221,7 @@ def process_destination(
                 print(f"  Dropped unknown columns: {', '.join(sorted(dropped))}")
 
         # Check geometry column
-        geom_exists = has_column(dest_url, dest_key, dest_schema, table, "geometry")
+        geom_exists = ASSUME_GEOMETRY_COLUMN or has_column(dest_url, dest_key, dest_schema, table, "geometry")
         if geom_exists and any("geometry" in r for r in work_records[:1]):
             print("  Geometry: included")
         else:
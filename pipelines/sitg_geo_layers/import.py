@@ -31,6 +31,8 @@ Environment variables:
     RE_LLM_SUPABASE_URL              - re-llm Supabase project URL (required)
     RE_LLM_SUPABASE_SERVICE_ROLE_KEY - service_role key (required)
     RE_LLM_SCHEMA                    - target schema (default: bronze_ch)
+    ASSUME_GEOMETRY_COLUMN           - 1 = skip the geometry-column probe (optional;
+                                       re-run once without it after a schema change)
 """
 
 import json
@@ -41,6 +43,7 @@ import requests
 
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from shared.postgrest_meta import ASSUME_GEOMETRY_COLUMN
 from shared.supabase_client import batch_upsert
 from shared.sitg_arcgis import fetch_all_features
 from shared.freshness import get_dataset_meta, update_dataset_meta
@@ -391,7 +394,7 @@ def process_destination(
                 print(f"  Dropped unknown columns: {', '.join(sorted(dropped))}")
 
         # Check geometry column
-        geom_exists = has_column(dest_url, dest_key, dest_schema, table, "geometry")
+        geom_exists = ASSUME_GEOMETRY_COLUMN or has_column(dest_url, dest_key, dest_schema, table, "geometry")
         if geom_exists and any("geometry" in r for r in work_records[:1]):
             print("  Geometry: included (PostGIS)")
         else:
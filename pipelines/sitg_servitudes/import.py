@@ -31,15 +31,16 @@ Environment variables:
     LAMAP_SCHEMA                - target schema (default: bronze)
     YOONEET_SUPABASE_URL        - Yooneet Supabase project URL (optional)
     YOONEET_SUPABASE_SERVICE_KEY - Yooneet service_role key (optional)
+    ASSUME_GEOMETRY_COLUMN       - 1 = skip the geometry-column probe (optional;
+                                   re-run once without it after a schema change)
 """
 
 import os
 import sys
 
-import requests
-
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from shared.postgrest_meta import ASSUME_GEOMETRY_COLUMN, get_row_count, has_column
 from shared.supabase_client import batch_upsert
 from shared.sitg_arcgis import fetch_all_features
 
@@ -58,46 +59,6 @@ CONFLICT_COLUMN = "objectid"
 EXCLUDE_FIELDS = {"iteration"}
 
 
-# ──────────────────────────────────────────────────────────────
-# Helpers
-# ──────────────────────────────────────────────────────────────
-
-def get_row_count(url: str, key: str, schema: str, table: str) -> int | None:
-    """Get current row count via PostgREST HEAD request."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select=count"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-        "Prefer": "count=exact",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.head(endpoint, headers=headers, timeout=30)
-        cr = r.headers.get("content-range", "")
-        if "/" in cr:
-            return int(cr.split("/")[1])
-    except Exception as e:
-        print(f"  Warning: could not get row count: {e}")
-    return None
-
-
-def has_column(url: str, key: str, schema: str, table: str, column: str) -> bool:
-    """Check if a column exists in the target table via PostgREST."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select={column}&limit=0"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.get(endpoint, headers=headers, timeout=10)
-        return r.status_code == 200
-    except Exception:
-        return False
-
-
 # ──────────────────────────────────────────────────────────────
 # Destination config
 # ──────────────────────────────────────────────────────────────
@@ -159,13 +120,16 @@ def main():
         print("  No records fetched. Exiting.")
         return
 
-    # Remove excluded fields (e.g. 'iteration' from JS era)
-    for r in records:
-        for f in EXCLUDE_FIELDS:
-            r.pop(f, None)
-
     print(f"\n  Total records to upsert: {len(records):,}")
 
+    # Excluded fields (e.g. 'iteration' from JS era) go for every
+    # destination: drop them in place, once.  Attribute keys are uniform per
+    # layer, so the first record tells whether they are there at all.
+    if not EXCLUDE_FIELDS.isdisjoint(records[0]):
+        for r in records:
+            for field in EXCLUDE_FIELDS:
+                r.pop(field, None)
+
     # ── Step 2: Upsert to each destination ────────────────────
     primary_ok = False  # lamap_db (first dest) must succeed
 
@@ -182,14 +146,26 @@ def main():
         print(f"  Rows before: {rows_before or 'unknown'}")
 
         # Check if geometry column exists
-        geom_exists = has_column(dest["url"], dest["key"], dest["schema"], TABLE_NAME, "geometry")
+        geom_exists = ASSUME_GEOMETRY_COLUMN or has_column(
+            dest["url"], dest["key"], dest["schema"], TABLE_NAME, "geometry"
+        )
 
         if geom_exists:
             print("  Geometry column: found, including geometry data")
-            upsert_records = records
         else:
             print("  Geometry column: NOT FOUND, stripping geometry from records")
             print(f"  (To add it: ALTER TABLE {dest['schema']}.\"{TABLE_NAME}\" ADD COLUMN geometry text;)")
+
+        # Strip geometry if needed.  The last destination can strip in place;
+        # earlier ones copy (a later destination may still want geometry),
+        # and the copy is released right after its upsert.
+        if geom_exists:
+            upsert_records = records
+        elif i == len(destinations) - 1:
+            for r in records:
+                r.pop("geometry", None)
+            upsert_records = records
+        else:
             upsert_records = [{k: v for k, v in r.items() if k != "geometry"} for r in records]
 
         # Upsert
@@ -200,11 +176,15 @@ def main():
             records=upsert_records,
             conflict_column=CONFLICT_COLUMN,
             schema=dest["schema"],
-            batch_size=500,
+            batch_size=None,  # auto: sized from the row payload
         )
+        del upsert_records
 
-        # Row count AFTER
-        rows_after = get_row_count(dest["url"], dest["key"], dest["schema"], TABLE_NAME)
+        # Row count AFTER (nothing written → nothing to re-count)
+        rows_after = (
+            get_row_count(dest["url"], dest["key"], dest["schema"], TABLE_NAME)
+            if upserted else rows_before
+        )
 
         print(f"\n  Results for {dest['name']}:")
         print(f"    Upserted:     {upserted:,}")
@@ -21,15 +21,16 @@ Environment variables:
     LAMAP_SUPABASE_URL          - Lamap Supabase project URL (required)
     LAMAP_SUPABASE_SERVICE_KEY  - service_role key (required)
     LAMAP_SCHEMA                - target schema (default: bronze)
+    ASSUME_GEOMETRY_COLUMN      - 1 = skip the geometry-column probe (optional;
+                                  re-run once without it after a schema change)
 """
 
 import os
 import sys
 
-import requests
-
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from shared.postgrest_meta import ASSUME_GEOMETRY_COLUMN, get_row_count, has_column, load_schema
 from shared.supabase_client import batch_upsert
 from shared.sitg_arcgis import fetch_all_features
 
@@ -62,46 +63,6 @@ DATASETS = [
 EXCLUDE_FIELDS = {"iteration"}
 
 
-# ──────────────────────────────────────────────────────────────
-# Helpers
-# ──────────────────────────────────────────────────────────────
-
-def get_row_count(url: str, key: str, schema: str, table: str) -> int | None:
-    """Get current row count via PostgREST HEAD request."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select=count"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-        "Prefer": "count=exact",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.head(endpoint, headers=headers, timeout=30)
-        cr = r.headers.get("content-range", "")
-        if "/" in cr:
-            return int(cr.split("/")[1])
-    except Exception as e:
-        print(f"  Warning: could not get row count: {e}")
-    return None
-
-
-def has_column(url: str, key: str, schema: str, table: str, column: str) -> bool:
-    """Check if a column exists in the target table via PostgREST."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select={column}&limit=0"
-    headers = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-    }
-    if schema and schema != "public":
-        headers["Accept-Profile"] = schema
-    try:
-        r = requests.get(endpoint, headers=headers, timeout=10)
-        return r.status_code == 200
-    except Exception:
-        return False
-
-
 # ──────────────────────────────────────────────────────────────
 # Main
 # ──────────────────────────────────────────────────────────────
@@ -146,40 +107,48 @@ def main():
             print("  No records fetched. Skipping.")
             continue
 
-        # Remove excluded fields
-        for r in records:
-            for f in EXCLUDE_FIELDS:
-                r.pop(f, None)
-
         print(f"  Records to upsert: {len(records):,}")
 
         # ── Row count BEFORE ──
         rows_before = get_row_count(dest_url, dest_key, dest_schema, table)
         print(f"  Rows before: {rows_before or 'unknown'}")
 
-        # ── Check geometry column ──
-        geom_exists = has_column(dest_url, dest_key, dest_schema, table, "geometry")
+        # ── Check geometry column (one schema request covers all datasets) ──
+        tables = {} if ASSUME_GEOMETRY_COLUMN else load_schema(dest_url, dest_key, dest_schema)
+        if table in tables:
+            geom_exists = "geometry" in tables[table]
+        else:
+            geom_exists = ASSUME_GEOMETRY_COLUMN or has_column(dest_url, dest_key, dest_schema, table, "geometry")
         if geom_exists:
             print("  Geometry column: found")
-            upsert_records = records
         else:
             print("  Geometry column: NOT FOUND, stripping geometry")
             print(f"  (Add it: ALTER TABLE {dest_schema}.\"{table}\" ADD COLUMN geometry text;)")
-            upsert_records = [{k: v for k, v in r.items() if k != "geometry"} for r in records]
+
+        # Drop excluded fields (e.g. 'iteration' from JS era, + geometry if
+        # needed) in place: the records are this dataset's alone, so no second
+        # list is built.  Attribute keys are uniform per layer, so the first
+        # record tells whether excluded fields are there at all (geometry can
+        # be missing on some features, so stripping it always takes the pass).
+        drop = EXCLUDE_FIELDS if geom_exists else EXCLUDE_FIELDS | {"geometry"}
+        if not geom_exists or not drop.isdisjoint(records[0]):
+            for r in records:
+                for field in drop:
+                    r.pop(field, None)
 
         # ── Upsert ──
         upserted = batch_upsert(
             url=dest_url,
             key=dest_key,
             table=table,
-            records=upsert_records,
+            records=records,
             conflict_column=conflict,
             schema=dest_schema,
-            batch_size=500,
+            batch_size=None,  # auto: sized from the row payload
         )
 
-        # ── Row count AFTER ──
-        rows_after = get_row_count(dest_url, dest_key, dest_schema, table)
+        # ── Row count AFTER (nothing written → nothing to re-count) ──
+        rows_after = get_row_count(dest_url, dest_key, dest_schema, table) if upserted else rows_before
 
         print(f"\n  Results:")
         print(f"    Upserted:     {upserted:,}")
@@ -18,28 +18,46 @@ Environment variables (set by GitHub Actions secrets):
     SUPABASE_SERVICE_KEY      - camelote_data service_role key (required)
     SUPABASE_SCHEMA           - camelote_data schema (default: public)
     SUPABASE_TABLE            - camelote_data table (default: zefix_companies)
+    SUPABASE_DIRECT_DSN       - camelote_data direct Postgres DSN (optional;
+                                enables the COPY bulk-upsert path)
 
     LAMAP_SUPABASE_URL        - lamap project URL (optional)
     LAMAP_SUPABASE_SERVICE_KEY - lamap service_role key (optional)
     LAMAP_SCHEMA              - lamap schema (default: bronze)
     LAMAP_TABLE               - lamap table (default: zefix_companies)
+    LAMAP_DIRECT_DSN          - lamap direct Postgres DSN (optional)
 
     YOONEET_SUPABASE_URL        - yooneet project URL (optional)
     YOONEET_SUPABASE_SERVICE_KEY - yooneet service_role key (optional)
     YOONEET_SCHEMA              - yooneet schema (default: public)
     YOONEET_TABLE               - yooneet table (default: zefix_companies)
+    YOONEET_DIRECT_DSN          - yooneet direct Postgres DSN (optional)
 """
 
 import os
 import sys
-import csv
-import io
-import time
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Add repo root to path so we can import shared/
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
-from shared.supabase_client import batch_upsert
+from shared.pg_copy_upsert import bulk_upsert
+
+# Progress goes through a QueueHandler; one listener thread does the stdout
+# writes, so download/upsert threads never block on (or contend for) stdout.
+log = logging.getLogger("zefix")
 
 CSV_BASE_URL = "https://data-bs.ch/stata/zefix_handelsregister/all_cantons/companies_{}.csv"
 
@@ -49,11 +67,61 @@ ALL_CANTONS = [
     "TI", "UR", "VD", "VS", "ZG", "ZH",
 ]
 
+# Cantons are downloaded + parsed by DOWNLOAD_WORKERS producer threads
+# (= open connections to data-bs.ch) while the main thread upserts.  At most
+# QUEUE_DEPTH parsed chunks wait between the two stages.
+DOWNLOAD_WORKERS = 2
+QUEUE_DEPTH = 4
+PUT_TIMEOUT = 1  # seconds a producer blocks on a full queue before re-checking for a stop
+
+# Chunks upserted concurrently (each POSTs to every destination), so batch
+# round trips overlap instead of stacking.  ZEFIX_UPSERT_WORKERS overrides;
+# 1 = one chunk at a time.
+UPSERT_WORKERS = int(os.environ.get("ZEFIX_UPSERT_WORKERS", "4"))
+
+# Rows parsed + upserted at a time; a canton is never fully resident
+STREAM_CHUNK = 5000
+
+# CSV columns read by parse_csv(); every other column is skipped by the
+# Arrow reader, and any of these missing from a file reads as null.
+CSV_COLUMNS = [
+    "company_legal_name", "company_uid",
+    "company_type_fr", "company_type_de",
+    "locality", "municipality",
+]
+
+# format_uid() helpers: already-formatted UIDs match the regex outright;
+# anything else has its non-digits (Latin-1 range) deleted in one C pass.
+_UID_RE = re.compile(r"CHE-(\d{3})\.(\d{3})\.(\d{3})", re.ASCII)
+_NON_DIGITS = str.maketrans("", "", "".join(chr(i) for i in range(256) if not chr(i).isdigit()))
+
+# One keep-alive connection pool for the canton downloads (retries connection
+# errors; upserts go through shared.supabase_client).  The CSVs are plain
+# text and compress well, so always ask for a compressed transfer;
+# download_csv() decodes it on the fly.
+_SESSION = requests.Session()
+_SESSION.headers["Accept-Encoding"] = "gzip, deflate"
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3)),
+)
+
+
+def _secondary_configured(url_var, key_var):
+    """True if both env vars are set; warns when only one of them is."""
+    url, key = os.environ.get(url_var), os.environ.get(key_var)
+    if url and key:
+        return True
+    if url or key:
+        log.warning("  WARNING: %s and %s must both be set, skipping destination", url_var, key_var)
+    return False
+
 
 def build_destinations():
     """
     Build list of destination Supabase projects from environment variables.
-    camelote_data is always required. Others are optional.
+    camelote_data is always required. Others are optional: each needs both
+    its URL and key, and is skipped with a warning if only one is set.
     """
     destinations = []
 
@@ -64,45 +132,56 @@ def build_destinations():
         "key": os.environ.get("SUPABASE_SERVICE_KEY", ""),
         "schema": os.environ.get("SUPABASE_SCHEMA", "public"),
         "table": os.environ.get("SUPABASE_TABLE", "zefix_companies"),
+        "dsn": os.environ.get("SUPABASE_DIRECT_DSN", ""),
     })
 
     # Secondary — lamap (optional)
-    if os.environ.get("LAMAP_SUPABASE_URL"):
+    if _secondary_configured("LAMAP_SUPABASE_URL", "LAMAP_SUPABASE_SERVICE_KEY"):
         destinations.append({
             "name": "lamap",
             "url": os.environ["LAMAP_SUPABASE_URL"],
             "key": os.environ["LAMAP_SUPABASE_SERVICE_KEY"],
             "schema": os.environ.get("LAMAP_SCHEMA", "bronze"),
             "table": os.environ.get("LAMAP_TABLE", "zefix_companies"),
+            "dsn": os.environ.get("LAMAP_DIRECT_DSN", ""),
         })
 
     # Secondary — yooneet (optional)
-    if os.environ.get("YOONEET_SUPABASE_URL"):
+    if _secondary_configured("YOONEET_SUPABASE_URL", "YOONEET_SUPABASE_SERVICE_KEY"):
         destinations.append({
             "name": "yooneet",
             "url": os.environ["YOONEET_SUPABASE_URL"],
             "key": os.environ["YOONEET_SUPABASE_SERVICE_KEY"],
             "schema": os.environ.get("YOONEET_SCHEMA", "public"),
             "table": os.environ.get("YOONEET_TABLE", "zefix_companies"),
+            "dsn": os.environ.get("YOONEET_DIRECT_DSN", ""),
         })
 
     return destinations
 
 
 def download_csv(canton):
-    """Download CSV for one canton. Forces UTF-8 to avoid mojibake."""
+    """Open a streamed download of one canton's CSV. Caller must close it."""
     url = CSV_BASE_URL.format(canton)
-    r = requests.get(url, timeout=120)
+    r = _SESSION.get(url, timeout=120, stream=True)
     r.raise_for_status()
-    r.encoding = "utf-8"  # CRITICAL: prevents "SociÃ©tÃ©" instead of "Société"
-    return r.text
+    r.raw.decode_content = True  # undo any Content-Encoding (gzip) transparently
+    r.raw.auto_close = False     # let the CSV reader see EOF instead of a closed file
+    return r
 
 
 def format_uid(raw):
     """Convert raw UID digits to CHE-XXX.XXX.XXX format."""
     if not raw:
         return None, None
-    digits = "".join(c for c in str(raw) if c.isdigit())
+    s = str(raw)
+    m = _UID_RE.fullmatch(s)
+    if m:
+        return s, int("".join(m.groups()))
+    digits = s.translate(_NON_DIGITS)
+    if not digits.isascii():
+        # Rare: characters outside Latin-1 survive the table
+        digits = "".join(c for c in digits if c.isdigit())
     if len(digits) >= 9:
         digits = digits[:9]
         formatted = f"CHE-{digits[:3]}.{digits[3:6]}.{digits[6:9]}"
@@ -110,128 +189,360 @@ def format_uid(raw):
     return raw, None
 
 
-def parse_csv(csv_text, canton):
-    """Parse CSV into list of dicts matching zefix_companies schema."""
-    reader = csv.DictReader(io.StringIO(csv_text))
-    records = []
+def format_uids(uids):
+    """Vectorised format_uid() over an Arrow string array of stripped UIDs.
 
-    for row in reader:
-        name = (row.get("company_legal_name") or "").strip()
-        uid_raw = (row.get("company_uid") or "").strip()
-        legal_form = (row.get("company_type_fr") or row.get("company_type_de") or "").strip()
-        city = (row.get("locality") or row.get("municipality") or "").strip()
-
-        if not name:
+    Returns (formatted, numeric) Python lists.  Non-ASCII values (where
+    Unicode digit rules apply) go through format_uid() one by one.
+    """
+    digits = pc.replace_substring_regex(uids, "[^0-9]", "")
+    full = pc.greater_equal(pc.binary_length(digits), 9)
+    d9 = pc.if_else(full, pc.utf8_slice_codeunits(digits, 0, 9), None)
+    formatted = pc.binary_join_element_wise(
+        "CHE-", pc.utf8_slice_codeunits(d9, 0, 3),
+        ".", pc.utf8_slice_codeunits(d9, 3, 6),
+        ".", pc.utf8_slice_codeunits(d9, 6, 9),
+        "",
+    )
+    # Too few digits → raw value kept, empty → None (as format_uid)
+    formatted = pc.if_else(full, formatted, pc.if_else(pc.equal(uids, ""), None, uids))
+    out_uid = formatted.to_pylist()
+    out_num = pc.cast(d9, pa.int64()).to_pylist()
+
+    if not pc.all(pc.string_is_ascii(uids)).as_py():
+        for i in pc.indices_nonzero(pc.invert(pc.string_is_ascii(uids))).to_pylist():
+            out_uid[i], out_num[i] = format_uid(uids[i].as_py())
+    return out_uid, out_num
+
+
+def _first_non_empty(primary, fallback):
+    """Arrow equivalent of `(primary or fallback or "").strip()`."""
+    use_primary = pc.fill_null(pc.not_equal(primary, ""), False)
+    return pc.utf8_trim_whitespace(pc.fill_null(pc.if_else(use_primary, primary, fallback), ""))
+
+
+def parse_csv(resp, canton):
+    """Stream-parse a canton CSV response, yielding dicts matching zefix_companies schema.
+
+    Parsing, trimming, UID formatting and the empty-name filter run in
+    Arrow's native CSV reader, one block (~1 MB) at a time; only surviving
+    rows become dicts.
+    """
+    # CRITICAL: decode as UTF-8 — prevents "SociÃ©tÃ©" instead of "Société"
+    reader = pa_csv.open_csv(
+        resp.raw,
+        read_options=pa_csv.ReadOptions(encoding="utf8"),
+        # Malformed rows (wrong field count) are skipped, not fatal
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=lambda row: "skip"),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={c: pa.string() for c in CSV_COLUMNS},
+            include_columns=CSV_COLUMNS,
+            include_missing_columns=True,
+        ),
+    )
+
+    for batch in reader:
+        names = pc.utf8_trim_whitespace(pc.fill_null(batch["company_legal_name"], ""))
+        keep = pc.not_equal(names, "")
+        if not pc.any(keep).as_py():
             continue
 
-        uid_formatted, uid_num = format_uid(uid_raw)
-
-        records.append({
-            "uid": uid_formatted,
-            "uid_raw": uid_num,
-            "name": name,
-            "legal_form": legal_form,
-            "status": "ACTIVE",
-            "city": city,
-            "canton": canton,
-            "source": "csv_import",
-        })
+        uids = pc.filter(pc.utf8_trim_whitespace(pc.fill_null(batch["company_uid"], "")), keep)
+        columns = zip(
+            pc.filter(names, keep).to_pylist(),
+            *format_uids(uids),
+            pc.filter(_first_non_empty(batch["company_type_fr"], batch["company_type_de"]), keep).to_pylist(),
+            pc.filter(_first_non_empty(batch["locality"], batch["municipality"]), keep).to_pylist(),
+        )
 
-    return records
+        for name, uid_formatted, uid_num, legal_form, city in columns:
+            yield {
+                "uid": uid_formatted,
+                "uid_raw": uid_num,
+                "name": name,
+                "legal_form": legal_form,
+                "status": "ACTIVE",
+                "city": city,
+                "canton": canton,
+                "source": "csv_import",
+            }
+
+
+def dedupe_uids(records, rank, owners):
+    """Dedupe a chunk by UID, resolving repeats in canton order.
+
+    Within the chunk the last row per UID wins.  Across chunks `owners`
+    maps each UID (numeric where there is one: smaller than the string) to
+    the (rank, upsert future) of the chunk that last sent it, where `rank`
+    is the canton's position in ALL_CANTONS.  A row is dropped only if a
+    later canton already claimed its UID, so the winner is the row the
+    sequential loop would have written last (the last canton to list the
+    company, last row of that canton's file), whatever order the parallel
+    producers finish in.  Records without a UID are always kept.
+
+    Returns (unique records, their UIDs, superseded futures): the caller
+    waits for the superseded upserts before sending this chunk, so the
+    winning row is also the last one written, and then records the UIDs in
+    `owners` against the new future.
+    """
+    unique = {}
+    anonymous = []
+    superseded = set()
+    for r in records:
+        key = r["uid_raw"] if r["uid_raw"] is not None else r["uid"]
+        if key is None:
+            anonymous.append(r)
+            continue
+        owner = owners.get(key)
+        if owner is not None:
+            if owner[0] > rank:
+                continue
+            superseded.add(owner[1])
+        unique[key] = r
+    return list(unique.values()) + anonymous, unique.keys(), superseded
 
 
-def upsert_to_destinations(destinations, records, canton):
-    """
-    Upsert parsed records to all destinations.
-    Returns dict of {dest_name: rows_upserted}.
+def upsert_to_destination(dest, records, canton):
+    """Upsert parsed records to one destination. Returns rows upserted
+    (None if the upsert raised).
+
+    With a direct DSN the chunk is COPYed + merged in one transaction;
+    otherwise (or if that fails) it goes through PostgREST.
     """
-    results = {}
-    for dest in destinations:
-        print(f"  → {dest['name']} ({dest['schema']}.{dest['table']})")
-        upserted = batch_upsert(
+    log.info("  [%s] → %s (%s.%s)", canton, dest["name"], dest["schema"], dest["table"])
+    try:
+        upserted = bulk_upsert(
             url=dest["url"],
             key=dest["key"],
             table=dest["table"],
             records=records,
             conflict_column="uid",
             schema=dest["schema"],
-            batch_size=500,
+            batch_size=None,  # auto: sized from the row payload
+            dsn=dest["dsn"],
         )
-        results[dest["name"]] = upserted
-        print(f"    Upserted: {upserted}/{len(records)} rows")
-    return results
+    except Exception as e:
+        # Reported as a failed chunk in the summary, not raised out of the run
+        log.error("  [%s]   %s UPSERT FAILED: %s", canton, dest["name"], e)
+        return None
+    log.info("  [%s]   %s upserted: %d/%d rows", canton, dest["name"], upserted, len(records))
+    return upserted
 
 
-def import_canton(canton, destinations):
-    """Download + parse + upsert one canton to all destinations."""
-    print(f"\n{'='*50}")
-    print(f"  Canton: {canton}")
-    print(f"{'='*50}")
+def upsert_to_destinations(destinations, records, canton):
+    """
+    Upsert parsed records to all destinations, concurrently (the writes are
+    independent; records are only read).
+    Returns dict of {dest_name: rows_upserted or None on failure}.
+    """
+    if len(destinations) == 1:
+        dest = destinations[0]
+        return {dest["name"]: upsert_to_destination(dest, records, canton)}
+
+    with ThreadPoolExecutor(max_workers=len(destinations)) as pool:
+        futures = {
+            pool.submit(upsert_to_destination, dest, records, canton): dest["name"]
+            for dest in destinations
+        }
+        return {futures[f]: f.result() for f in as_completed(futures)}
 
-    # Download (once)
-    try:
-        csv_text = download_csv(canton)
-    except Exception as e:
-        print(f"  DOWNLOAD FAILED: {e}")
-        return None  # signal failure
 
-    # Parse (once)
-    records = parse_csv(csv_text, canton)
-    print(f"  Downloaded: {len(records)} rows")
+def _put(out, item, stop):
+    """Put `item` on the bounded queue, giving up once `stop` is set.
 
-    if not records:
-        print("  No records to import, skipping")
-        return {}
+    Returns False if it gave up (the consumer has stopped reading).
+    """
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
 
-    # Upsert to all destinations
-    results = upsert_to_destinations(destinations, records, canton)
-    return results
+
+def produce_canton(canton, out, stop):
+    """Download + parse one canton, putting chunks of rows on the `out` queue.
+
+    Always ends with a (canton, None, ok) sentinel, even on failure, so the
+    consumer knows the canton is finished — unless `stop` is set, in which
+    case the consumer is gone and the producer just returns.
+    """
+    if stop.is_set():  # queued behind a run that has already stopped
+        return
+    log.info("  [%s] Starting", canton)
+    ok = False
+    total = 0
+    try:
+        # Download (once, streamed)
+        try:
+            resp = download_csv(canton)
+        except Exception as e:
+            log.error("  [%s] DOWNLOAD FAILED: %s", canton, e)
+            return
+
+        # Parse, one chunk of rows at a time (blocks while the queue is full)
+        with resp:
+            rows = parse_csv(resp, canton)
+            try:
+                while chunk := list(islice(rows, STREAM_CHUNK)):
+                    total += len(chunk)
+                    if not _put(out, (canton, chunk, True), stop):
+                        return
+            except Exception as e:
+                log.error("  [%s] DOWNLOAD FAILED after %d rows: %s", canton, total, e)
+                return
+
+        ok = True
+        log.info("  [%s] Downloaded: %d rows", canton, total)
+        if not total:
+            log.info("  [%s] No records to import, skipping", canton)
+    finally:
+        _put(out, (canton, None, ok), stop)
+
+
+def start_logging():
+    """Route the `zefix` logger through a queue; returns the started listener."""
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(records, stream)
+
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
 
 
 def main():
+    listener = start_logging()
+    try:
+        run()
+    finally:
+        listener.stop()  # flushes queued messages, also on sys.exit()
+
+
+def run():
     # Build destinations from env vars
     destinations = build_destinations()
 
     # Validate primary destination
     primary = destinations[0]
     if not primary["url"] or not primary["key"]:
-        print("ERROR: SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
+        log.error("ERROR: SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
         sys.exit(1)
 
     dest_names = [d["name"] for d in destinations]
 
-    print("=" * 50)
-    print("  Zefix Import Pipeline")
-    print(f"  Destinations: {', '.join(dest_names)}")
-    print(f"  Cantons: ALL ({len(ALL_CANTONS)})")
-    print("=" * 50)
+    log.info("=" * 50)
+    log.info("  Zefix Import Pipeline")
+    log.info("  Destinations: %s", ", ".join(dest_names))
+    log.info("  Cantons: ALL (%d)", len(ALL_CANTONS))
+    log.info("=" * 50)
 
-    # Track totals per destination
+    # Track totals (and failed chunks) per destination
     totals = {d["name"]: 0 for d in destinations}
+    failed_chunks = {d["name"]: 0 for d in destinations}
     failed_cantons = []
 
-    for canton in ALL_CANTONS:
-        results = import_canton(canton, destinations)
-        if results is None:
-            failed_cantons.append(canton)
-        else:
-            for dest_name, count in results.items():
-                totals[dest_name] += count
-        time.sleep(0.5)  # rate limiting between cantons
+    # UID → (canton rank, upsert future) of the chunk that sent it: a second
+    # row for the same company (duplicate line, or listed under two cantons)
+    # would redo the ON CONFLICT update — or fail the whole batch if both
+    # land in the same POST.  See dedupe_uids for which row wins.
+    owners = {}
+    rank = {canton: i for i, canton in enumerate(ALL_CANTONS)}
+    duplicates = 0
+
+    # Producers download + parse cantons; this thread dedupes their chunks
+    # and hands them to the upsert pool.  The bounded queue and the cap on
+    # in-flight upserts together bound how many parsed rows sit in memory.
+    chunks = queue.Queue(maxsize=QUEUE_DEPTH)
+    stop = threading.Event()
+    remaining = len(ALL_CANTONS)
+    in_flight = {}  # upsert future → (canton, chunk UIDs)
+
+    def collect(futures):
+        for future in futures:
+            canton, uids = in_flight.pop(future)
+            ok = True
+            for dest_name, count in future.result().items():
+                if count is None:
+                    ok = False
+                    failed_chunks[dest_name] += 1
+                    if canton not in failed_cantons:
+                        failed_cantons.append(canton)
+                else:
+                    totals[dest_name] += count
+            if not ok:
+                # Release the failed chunk's UIDs so a row for the same
+                # company from an earlier canton is still written
+                for uid in uids:
+                    if owners.get(uid, (None, None))[1] is future:
+                        del owners[uid]
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool, \
+            ThreadPoolExecutor(max_workers=max(1, UPSERT_WORKERS)) as upsert_pool:
+        try:
+            for canton in ALL_CANTONS:
+                pool.submit(produce_canton, canton, chunks, stop)
+
+            while remaining:
+                canton, chunk, ok = chunks.get()
+                if chunk is None:  # canton finished
+                    remaining -= 1
+                    if not ok and canton not in failed_cantons:
+                        failed_cantons.append(canton)
+                    continue
+                unique, uids, superseded = dedupe_uids(chunk, rank[canton], owners)
+                if len(unique) < len(chunk):
+                    duplicates += len(chunk) - len(unique)
+                    log.info("  [%s] Skipped %d duplicate UIDs", canton, len(chunk) - len(unique))
+                if not unique:
+                    continue
+                superseded = [f for f in superseded if f in in_flight]
+                if superseded:
+                    collect(wait(superseded).done)
+                if len(in_flight) >= max(1, UPSERT_WORKERS):
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                future = upsert_pool.submit(upsert_to_destinations, destinations, unique, canton)
+                uids = list(uids)
+                in_flight[future] = (canton, uids)
+                for uid in uids:
+                    owners[uid] = (rank[canton], future)
+
+            collect(wait(in_flight).done)
+        finally:
+            # If the loop raised, producers may be blocked on the full
+            # queue: tell them to give up and empty it, so both pools can
+            # shut down instead of hanging on join; cantons not started yet
+            # are cancelled rather than downloaded
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            while True:
+                try:
+                    chunks.get_nowait()
+                except queue.Empty:
+                    break
+
+    failed_cantons.sort(key=ALL_CANTONS.index)
 
     # Summary
-    print("\n" + "=" * 50)
-    print("  IMPORT COMPLETE")
+    log.info("\n" + "=" * 50)
+    log.info("  IMPORT COMPLETE")
     for dest_name, total in totals.items():
-        print(f"  {dest_name}: {total:,} companies upserted")
-    print(f"  Cantons OK: {len(ALL_CANTONS) - len(failed_cantons)}/{len(ALL_CANTONS)}")
+        log.info("  %s: %s companies upserted", dest_name, f"{total:,}")
+        if failed_chunks[dest_name]:
+            log.error("  %s: %d chunk(s) FAILED", dest_name, failed_chunks[dest_name])
+    log.info("  Duplicate UIDs skipped: %s", f"{duplicates:,}")
+    log.info("  Cantons OK: %d/%d", len(ALL_CANTONS) - len(failed_cantons), len(ALL_CANTONS))
 
     if failed_cantons:
-        print(f"  FAILED cantons: {', '.join(failed_cantons)}")
-        print("=" * 50)
+        log.error("  FAILED cantons: %s", ", ".join(failed_cantons))
+        log.info("=" * 50)
         sys.exit(1)
 
-    print("=" * 50)
+    log.info("=" * 50)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+"""
+Per-job log prefix for pipelines that run several jobs concurrently.
+
+Usage:
+    from shared.log_prefix import log, log_prefix, submit
+
+    with log_prefix("[SIT_AUTOR_DOSSIER] "):
+        log("  Fetching...")        # → "[SIT_AUTOR_DOSSIER]   Fetching..."
+        submit(pool, fetch, url)    # fetch() logs with the same prefix
+
+The prefix lives in a ContextVar, so each thread (or job) keeps its own
+and nothing global is swapped.  Pool workers don't inherit the submitting
+thread's context; submit() hands them a copy.  Outside log_prefix(), log()
+is plain print().
+"""
+
+import contextlib
+import contextvars
+import sys
+from concurrent.futures import Executor, Future
+
+_PREFIX: contextvars.ContextVar[str] = contextvars.ContextVar("log_prefix", default="")
+
+
+@contextlib.contextmanager
+def log_prefix(prefix: str):
+    """Prefix every log() line in this context (and jobs submit()ted from it)."""
+    token = _PREFIX.set(prefix)
+    try:
+        yield
+    finally:
+        _PREFIX.reset(token)
+
+
+def log(*values, sep: str = " ", file=None) -> None:
+    """print() stand-in that puts the current prefix before every line.
+
+    The text goes out in a single write, so concurrent lines never interleave.
+    """
+    text = sep.join(map(str, values))
+    prefix = _PREFIX.get()
+    if prefix:
+        text = "\n".join(prefix + line for line in text.split("\n"))
+    (file or sys.stdout).write(text + "\n")
+
+
+def submit(pool: Executor, fn, *args, **kwargs) -> Future:
+    """pool.submit() that runs `fn` with the caller's log prefix."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,299 @@
+"""
+Bulk upsert over a direct Postgres connection (COPY + INSERT ... ON CONFLICT).
+
+PostgREST upserts cost one HTTP round trip per batch.  For large loads this
+module instead:
+  1. COPYs all records into a temp staging table (same column types as the
+     target, no constraints), in a single round trip
+  2. Runs ONE  INSERT INTO target SELECT ... FROM staging
+               ON CONFLICT (key) DO UPDATE SET col = EXCLUDED.col, ...
+
+Same semantics as PostgREST's resolution=merge-duplicates: columns present in
+the records are overwritten, other columns keep their value / DB default.
+
+mode="merge" (Postgres 15+) runs step 2 as
+    MERGE INTO target USING staging ON key = key
+      WHEN MATCHED AND (row differs) THEN UPDATE ...
+      WHEN NOT MATCHED THEN INSERT ...
+instead, so re-loading unchanged rows writes nothing (no dead tuples, WAL or
+index churn).  Worth it for wide tables that are mostly re-loaded as-is.
+
+Usage:
+    from shared.pg_copy_upsert import bulk_upsert
+
+    count = bulk_upsert(
+        url=dest_url,
+        key=dest_key,
+        table="SIT_AUTOR_DOSSIER",
+        records=records,
+        conflict_column="objectid",
+        schema="bronze",
+        dsn=os.environ.get("LAMAP_DIRECT_DSN", ""),
+    )
+
+Without a DSN, or for small loads (<= COPY_THRESHOLD records), this is just
+shared.supabase_client.batch_upsert.  If the COPY path fails for any reason
+the same records are sent through batch_upsert instead.
+
+Connections are opened once per thread and DSN and reused by later calls, so
+streaming callers that upsert a page or chunk at a time don't reconnect each
+time.  They are closed at interpreter exit.
+"""
+
+import atexit
+import io
+import threading
+
+import orjson
+
+from shared.log_prefix import log
+from shared.supabase_client import batch_upsert, dedupe_records
+
+# Below this many records the PostgREST path is cheap enough
+COPY_THRESHOLD = 1024
+
+UPSERT_MODES = ("upsert", "merge")
+
+# pg_type OIDs of json / jsonb
+_JSON_TYPES = (114, 3802)
+
+_local = threading.local()
+_all_connections = []
+_connections_lock = threading.Lock()
+
+
+def _connection(dsn):
+    """This thread's open connection to `dsn` (one transaction at a time)."""
+    import psycopg2
+
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(dsn)
+    if conn is None or conn.closed:
+        conn = conns[dsn] = psycopg2.connect(dsn)
+        with _connections_lock:
+            _all_connections.append(conn)
+    return conn
+
+
+def _discard_connection(dsn):
+    """Close and forget this thread's connection to `dsn` after an error."""
+    conn = getattr(_local, "conns", {}).pop(dsn, None)
+    if conn is not None:
+        conn.close()
+
+
+@atexit.register
+def close_connections():
+    """Close every connection opened by copy_upsert."""
+    with _connections_lock:
+        for conn in _all_connections:
+            if not conn.closed:
+                conn.close()
+        _all_connections.clear()
+
+
+def _copy_value(val, json_column=False) -> str:
+    """Encode one value for COPY ... FROM STDIN (text format).
+
+    For json/jsonb columns every value is JSON-encoded, strings included,
+    which is what PostgREST stores for the same payload: a pre-encoded JSON
+    string lands as a JSON string, not as the object it spells out.
+    """
+    if val is None:
+        return r"\N"
+    if json_column:
+        s = orjson.dumps(val).decode()
+    elif isinstance(val, bool):
+        s = "true" if val else "false"
+    elif isinstance(val, (dict, list)):
+        s = orjson.dumps(val).decode()
+    else:
+        s = str(val)
+    return (
+        s.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _merge_statement(sql, target, staging, columns, keys, updates):
+    """MERGE ... WHEN MATCHED AND <changed> THEN UPDATE ... WHEN NOT MATCHED THEN INSERT."""
+    t, s = sql.Identifier("t"), sql.Identifier("s")
+
+    def qualified(alias, cols, cast=False):
+        fmt = "{}.{}::text" if cast else "{}.{}"
+        return sql.SQL(", ").join(sql.SQL(fmt).format(alias, sql.Identifier(c)) for c in cols)
+
+    on = sql.SQL(" AND ").join(
+        sql.SQL("t.{0} = s.{0}").format(sql.Identifier(k)) for k in keys
+    )
+    parts = [
+        sql.SQL("MERGE INTO {} AS t USING {} AS s ON {}").format(target, staging, on)
+    ]
+    if updates:
+        # Compare as text: not every type (json, some PostGIS builds) has '='
+        parts.append(
+            sql.SQL(
+                "WHEN MATCHED AND ROW({}) IS DISTINCT FROM ROW({}) THEN UPDATE SET {}"
+            ).format(
+                qualified(t, updates, cast=True),
+                qualified(s, updates, cast=True),
+                sql.SQL(", ").join(
+                    sql.SQL("{0} = s.{0}").format(sql.Identifier(c)) for c in updates
+                ),
+            )
+        )
+    parts.append(
+        sql.SQL("WHEN NOT MATCHED THEN INSERT ({}) VALUES ({})").format(
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            qualified(s, columns),
+        )
+    )
+    return sql.SQL(" ").join(parts)
+
+
+def copy_upsert(
+    dsn: str,
+    schema: str,
+    table: str,
+    records: list[dict],
+    conflict_column: str,
+    mode: str = "upsert",
+) -> int:
+    """
+    COPY records into a staging table and merge them into schema.table.
+
+    Args:
+        dsn:              libpq connection string for the target database
+        schema:           Target schema (e.g. "bronze")
+        table:            Target table name (case-sensitive, e.g. "Simap")
+        records:          List of dicts to upsert.  Keys missing from some
+                          records are sent as NULL; records sharing a
+                          conflict key are deduped first (last one wins).
+        conflict_column:  ON CONFLICT key, comma-separated if composite
+        mode:             "upsert" (INSERT ... ON CONFLICT) or "merge"
+                          (MERGE, skipping unchanged rows; Postgres 15+)
+
+    Returns:
+        Number of records processed (unchanged rows skipped by "merge" are
+        counted too).  Raises on any database error (the transaction is
+        rolled back).
+    """
+    if mode not in UPSERT_MODES:
+        raise ValueError(f"mode must be one of {UPSERT_MODES}, got {mode!r}")
+
+    from psycopg2 import sql
+
+    # One row per key: ON CONFLICT DO UPDATE / MERGE fail outright (21000)
+    # when the staging table holds the same key twice
+    records = dedupe_records(records, conflict_column)
+
+    columns = list(dict.fromkeys(k for r in records for k in r))
+    keys = [c.strip() for c in conflict_column.split(",")]
+    updates = [c for c in columns if c not in keys]
+
+    target = sql.Identifier(schema or "public", table)
+    staging = sql.Identifier("_stg_bulk_upsert")
+    col_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+
+    if mode == "merge":
+        statement = _merge_statement(sql, target, staging, columns, keys, updates)
+    else:
+        if updates:
+            on_conflict = sql.SQL("DO UPDATE SET {}").format(
+                sql.SQL(", ").join(
+                    sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in updates
+                )
+            )
+        else:
+            on_conflict = sql.SQL("DO NOTHING")
+        statement = sql.SQL(
+            "INSERT INTO {target} ({cols}) SELECT {cols} FROM {staging} "
+            "ON CONFLICT ({keys}) {on_conflict}"
+        ).format(
+            target=target,
+            cols=col_list,
+            staging=staging,
+            keys=sql.SQL(", ").join(map(sql.Identifier, keys)),
+            on_conflict=on_conflict,
+        )
+
+    conn = _connection(dsn)
+    try:
+        with conn:  # one transaction; commits on success, rolls back on error
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL(
+                        "CREATE TEMP TABLE {} ON COMMIT DROP AS "
+                        "SELECT {} FROM {} WITH NO DATA"
+                    ).format(staging, col_list, target)
+                )
+                cur.execute(sql.SQL("SELECT {} FROM {} LIMIT 0").format(col_list, staging))
+                json_columns = [d.type_code in _JSON_TYPES for d in cur.description]
+
+                buf = io.StringIO()
+                for r in records:
+                    buf.write("\t".join(
+                        _copy_value(r.get(c), is_json)
+                        for c, is_json in zip(columns, json_columns)
+                    ))
+                    buf.write("\n")
+                buf.seek(0)
+
+                cur.copy_expert(
+                    sql.SQL("COPY {} ({}) FROM STDIN").format(staging, col_list).as_string(cur),
+                    buf,
+                )
+                cur.execute(statement)
+    except Exception:
+        _discard_connection(dsn)
+        raise
+
+    return len(records)
+
+
+def bulk_upsert(
+    url,
+    key,
+    table,
+    records,
+    conflict_column,
+    schema="public",
+    batch_size=None,
+    dsn=None,
+    mode="upsert",
+):
+    """
+    Upsert via COPY when a DSN is available and the load is large enough,
+    otherwise (or on failure) via PostgREST batch_upsert.
+
+    Arguments match batch_upsert, plus `dsn` (direct Postgres connection
+    string; empty/None disables the COPY path) and `mode` ("upsert" or
+    "merge", see copy_upsert; the PostgREST fallback always upserts).
+    batch_size is passed straight through to the PostgREST path (default
+    None: batches sized from the payload).
+
+    Returns:
+        Total number of rows successfully upserted.
+    """
+    if dsn and records and len(records) > COPY_THRESHOLD:
+        log(f"    COPY {mode}: {len(records):,} rows → {schema}.{table}")
+        try:
+            count = copy_upsert(dsn, schema, table, records, conflict_column, mode=mode)
+            log(f"    COPY {mode}: OK")
+            return count
+        except Exception as e:
+            log(f"    COPY upsert failed ({e}), falling back to PostgREST")
+
+    return batch_upsert(
+        url=url,
+        key=key,
+        table=table,
+        records=records,
+        conflict_column=conflict_column,
+        schema=schema,
+        batch_size=batch_size,
+    )
@@ -0,0 +1,164 @@
+"""
+PostgREST table metadata helpers shared by the import pipelines.
+
+Handles:
+  - Row counts (GET limit=0 + Prefer: count=exact)
+  - Column existence / discovery / type lookups
+  - One keep-alive connection pool for all of the above
+
+Usage:
+    from shared.postgrest_meta import get_row_count, has_column, load_schema
+
+    rows_before = get_row_count(url, key, "bronze", "SIT_PROG_DENS")
+    tables = load_schema(url, key, "bronze")   # {table: columns}, one request
+    if "geometry" in tables.get("SIT_PROG_DENS", ()):
+        ...
+
+Lookups that can't change mid-run (columns, types) are cached per process,
+so multi-dataset / multi-destination loops only pay for them once.  Every
+helper swallows errors and returns a neutral value (None / False / empty),
+leaving the decision to the caller; those fallbacks are never cached, so a
+transient failure doesn't stick for the rest of the run.
+"""
+
+import functools
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from shared.log_prefix import log
+
+# One keep-alive connection pool for all metadata requests (retries
+# connection errors; upserts go through shared.supabase_client)
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.3)),
+)
+
+# ASSUME_GEOMETRY_COLUMN=1: the SITG tables' geometry column is taken as
+# given and never probed.  Schemas change rarely; after one does, run once
+# without the flag so a missing column is detected (and geometry stripped).
+ASSUME_GEOMETRY_COLUMN = os.environ.get("ASSUME_GEOMETRY_COLUMN", "") not in ("", "0")
+
+
+def _read_headers(key: str, schema: str) -> dict:
+    """PostgREST read headers, with Accept-Profile for non-public schemas."""
+    headers = {
+        "apikey": key,
+        "Authorization": f"Bearer {key}",
+    }
+    if schema and schema != "public":
+        headers["Accept-Profile"] = schema
+    return headers
+
+
+def get_row_count(url: str, key: str, schema: str, table: str) -> int | None:
+    """Get current row count via PostgREST (GET limit=0 + Prefer: count=exact).
+
+    limit=0 lets PostgREST skip materialising rows; HEAD still runs the full
+    SELECT and only drops the body.
+    """
+    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select=count&limit=0"
+    headers = {**_read_headers(key, schema), "Prefer": "count=exact"}
+    try:
+        r = SESSION.get(endpoint, headers=headers, timeout=30)
+        cr = r.headers.get("content-range", "")
+        if "/" in cr:
+            return int(cr.split("/")[1])
+    except Exception as e:
+        log(f"  Warning: could not get row count: {e}")
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def _column_exists(url: str, key: str, schema: str, table: str, column: str) -> bool:
+    """Cached probe behind has_column(); request errors and 5xx raise instead."""
+    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?select={column}&limit=0"
+    r = SESSION.get(endpoint, headers=_read_headers(key, schema), timeout=10)
+    if r.status_code >= 500:
+        r.raise_for_status()
+    return r.status_code == 200
+
+
+def has_column(url: str, key: str, schema: str, table: str, column: str) -> bool:
+    """Check if a column exists in the target table via PostgREST (cached per run).
+
+    Only answers the server actually gave are cached: a timeout or 5xx
+    returns False for this call and is probed again next time.
+    """
+    try:
+        return _column_exists(url, key, schema, table, column)
+    except Exception:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _table_columns(url: str, key: str, schema: str, table: str) -> frozenset[str]:
+    """Cached lookup behind get_table_columns(); anything but a 200 raises."""
+    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?limit=1"
+    r = SESSION.get(endpoint, headers=_read_headers(key, schema), timeout=15)
+    r.raise_for_status()
+    rows = r.json()
+    return frozenset(rows[0].keys()) if rows else frozenset()
+
+
+def get_table_columns(url: str, key: str, schema: str, table: str) -> frozenset[str]:
+    """Discover existing columns in a table via PostgREST.
+
+    One ``limit=1`` round trip per (url, schema, table), cached for the rest
+    of the run so multi-destination loops don't re-probe (failed lookups
+    are not cached).  Returns an empty set if the table is empty or
+    unreachable (columns can't be inferred).
+    """
+    try:
+        return _table_columns(url, key, schema, table)
+    except Exception as e:
+        log(f"  Warning: could not discover table columns: {e}")
+        return frozenset()
+
+
+@functools.lru_cache(maxsize=8)
+def _openapi_spec(url: str, key: str, schema: str) -> dict:
+    """Cached OpenAPI `definitions` behind _openapi_definitions(); errors raise."""
+    endpoint = f"{url.rstrip('/')}/rest/v1/"
+    headers = {**_read_headers(key, schema), "Accept": "application/openapi+json"}
+    r = SESSION.get(endpoint, headers=headers, timeout=30)
+    r.raise_for_status()
+    return r.json().get("definitions", {})
+
+
+def _openapi_definitions(url: str, key: str, schema: str) -> dict:
+    """`definitions` of PostgREST's OpenAPI description ({} if unavailable).
+
+    Only a successful fetch is cached; after an error the next call retries.
+    """
+    try:
+        return _openapi_spec(url, key, schema)
+    except Exception as e:
+        log(f"  Warning: could not load table schema: {e}")
+        return {}
+
+
+def load_schema(url: str, key: str, schema: str) -> dict[str, frozenset[str]]:
+    """Every table's columns in `schema`, from one PostgREST OpenAPI request.
+
+    Returns {} if the OpenAPI description is unavailable (callers then fall
+    back to per-table has_column() probes).
+    """
+    return {
+        table: frozenset(spec.get("properties", {}))
+        for table, spec in _openapi_definitions(url, key, schema).items()
+    }
+
+
+def get_column_format(url: str, key: str, schema: str, table: str, column: str) -> str:
+    """Postgres type of one column, from PostgREST's OpenAPI description.
+
+    e.g. "extensions.geometry(Point,4326)", "jsonb", "text".  Returns ""
+    when the description is unavailable.
+    """
+    props = _openapi_definitions(url, key, schema).get(table, {}).get("properties", {})
+    return props.get(column, {}).get("format", "")
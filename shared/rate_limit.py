@@ -0,0 +1,36 @@
+"""
+Thread-safe request pacing shared by the HTTP helpers.
+
+Usage:
+    from shared.rate_limit import RateLimiter
+
+    limiter = RateLimiter(8)   # at most 8 request starts per second
+    limiter.wait()             # call before each request, from any thread
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """Spaces request starts >= 1/rate apart, shared by all worker threads.
+
+    Caps aggregate QPS however many requests are in flight; a request only
+    waits when the previous one started too recently.  rate <= 0 disables
+    pacing.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
@@ -2,31 +2,63 @@
 Reusable helper for SITG ArcGIS REST API data pipelines.
 
 Handles:
-  - ArcGIS REST pagination (2000 records per page)
+  - ArcGIS REST pagination (2000 records per page, a few pages in flight,
+    request starts paced to MAX_PAGE_RATE per second)
+  - Streaming page parse (ijson: features are converted as they arrive)
   - Geometry extraction in WGS84 (outSR=4326)
   - Field name mapping (to snake_case, matching existing JS parsers)
   - Value normalisation (stringify + whitespace collapse)
   - Error handling with retries
+  - Optional disk cache of query responses (SITG_CACHE_DIR, for reruns)
 
 Usage:
-    from shared.sitg_arcgis import fetch_all_features
+    from shared.sitg_arcgis import fetch_all_features, iter_features
 
     records = fetch_all_features(
         base_url="https://vector.sitg.ge.ch/arcgis/rest/services/Hosted/LAYER/FeatureServer/0",
         include_geometry=True,
     )
 
+    # Or stream page by page (one page of records in memory at a time):
+    for page in iter_features(base_url, include_geometry=True):
+        upsert(page)
+
 Each record is a dict with snake_case keys matching the existing bronze table
 columns (produced by the legacy JS parsers).  If include_geometry=True, a
 'geometry' key is added containing the raw ArcGIS geometry as a JSON string
 in WGS84 (EPSG:4326).
+
+Environment variables:
+    SITG_CACHE_DIR  - cache ArcGIS responses in this directory (optional;
+                      unset = no cache).  Entries younger than SITG_CACHE_TTL
+                      are reused as-is; older ones are revalidated with
+                      If-None-Match / If-Modified-Since when the server sent
+                      a validator, else refetched.
+    SITG_CACHE_TTL  - seconds a cached response is reused (default 3600)
 """
 
 import re
-import json
+import contextlib
+import functools
+import hashlib
+import io
+import os
+import struct
+import tempfile
 import time
-
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import urlencode
+
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+from shared.log_prefix import log, submit
+from shared.rate_limit import RateLimiter
 
 # ── Retry config ──────────────────────────────────────────────
 MAX_RETRIES = 5
@@ -34,6 +66,15 @@ RETRY_BACKOFF = 2  # seconds: 2, 4, 8, 16, 32
 
 # ── ArcGIS defaults ──────────────────────────────────────────
 PAGE_SIZE = 2000  # ArcGIS FeatureServer default max
+CONCURRENT_PAGES = 4  # pages fetched ahead in parallel (bounded: shared public server)
+MAX_PAGE_RATE = 8  # page requests started per second, across all workers
+
+# Start of an ArcGIS error body ({"error": {"code": ..., "message": ...}})
+_ERROR_BODY_RE = re.compile(rb'\s*\{\s*"error"\s*:')
+
+# ── Disk cache (dev reruns / retries after a failed run) ─────
+CACHE_DIR = os.environ.get("SITG_CACHE_DIR", "")
+CACHE_TTL = float(os.environ.get("SITG_CACHE_TTL", "3600"))
 
 
 # ──────────────────────────────────────────────────────────────
@@ -41,15 +82,22 @@ PAGE_SIZE = 2000  # ArcGIS FeatureServer default max
 # and formatKeys from LamapParser)
 # ──────────────────────────────────────────────────────────────
 
+_NONWORD_RE = re.compile(r"[^\w\s]")
+_WS_RE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
 def key_to_snake_case(key: str) -> str:
     """
     Convert ArcGIS field name to snake_case.
 
     Exact match of JS:
         key.replace(/[^\\w\\s]/g, "_").replace(/\\s+/g, "_").toLowerCase()
+
+    Cached: a layer has a handful of field names, seen once per record.
     """
-    key = re.sub(r"[^\w\s]", "_", key)
-    key = re.sub(r"\s+", "_", key)
+    key = _NONWORD_RE.sub("_", key)
+    key = _WS_RE.sub("_", key)
     return key.lower()
 
 
@@ -63,118 +111,412 @@ def format_value(val):
     if val is None:
         return None
     s = str(val)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _WS_RE.sub(" ", s).strip()
     return s if s else None
 
 
+# ──────────────────────────────────────────────────────────────
+# Geometry encoding
+# ──────────────────────────────────────────────────────────────
+
+_WKB_POINT = 1
+_WKB_LINESTRING = 2
+_WKB_POLYGON = 3
+_WKB_MULTIPOINT = 4
+_WKB_MULTILINESTRING = 5
+_WKB_MULTIPOLYGON = 6
+_EWKB_SRID_FLAG = 0x20000000
+
+
+def _wkb_coords(points: list) -> bytes:
+    """Point count + packed little-endian XY doubles (Z/M are dropped)."""
+    flat = [c for p in points for c in p[:2]]
+    return struct.pack(f"<I{len(flat)}d", len(points), *flat)
+
+
+def _wkb_rings(rings: list) -> bytes:
+    """Ring count + each ring's coordinates (a WKB Polygon body)."""
+    return struct.pack("<I", len(rings)) + b"".join(_wkb_coords(r) for r in rings)
+
+
+def _ring_area2(ring: list) -> float:
+    """Twice the signed (shoelace) area of a closed ring; < 0 = clockwise."""
+    return sum(p[0] * q[1] - q[0] * p[1] for p, q in zip(ring, ring[1:]))
+
+
+def _ring_contains(ring: list, x: float, y: float) -> bool:
+    """Even-odd ray cast: is (x, y) inside the closed ring?"""
+    inside = False
+    for p, q in zip(ring, ring[1:]):
+        if (p[1] > y) != (q[1] > y) and x < p[0] + (y - p[1]) * (q[0] - p[0]) / (q[1] - p[1]):
+            inside = not inside
+    return inside
+
+
+def _group_rings(rings: list) -> list[list]:
+    """Split Esri rings into polygons, each an outer ring followed by its holes.
+
+    Esri outer rings run clockwise, holes counter-clockwise, in any order.
+    A hole joins the smallest outer ring containing its first vertex (the
+    first outer ring if none does).  Rings with no clockwise ring at all
+    stay one polygon, as they were.
+    """
+    areas = [_ring_area2(r) for r in rings]
+    shells = [i for i, a in enumerate(areas) if a < 0]
+    if not shells:
+        return [rings]
+    polygons = {i: [rings[i]] for i in shells}
+    for i, ring in enumerate(rings):
+        if areas[i] < 0:
+            continue
+        x, y = ring[0][0], ring[0][1]
+        owners = [s for s in shells if _ring_contains(rings[s], x, y)]
+        polygons[min(owners, key=lambda s: -areas[s]) if owners else shells[0]].append(ring)
+    return list(polygons.values())
+
+
+def esri_to_ewkb_hex(geom: dict, srid: int = 4326) -> str | None:
+    """
+    Encode an ArcGIS (EsriJSON) geometry as hex EWKB for a PostGIS column.
+
+    Mapping matches sitg_geo_layers.arcgis_to_geojson(), except that
+    rings with several outer (clockwise) rings become a MultiPolygon:
+        {"x", "y"}   → Point
+        {"points"}   → MultiPoint
+        {"paths"}    → MultiLineString
+        {"rings"}    → Polygon (outer ring first), or MultiPolygon
+
+    Returns None for empty / unsupported geometries.
+    """
+    if not isinstance(geom, dict):
+        return None
+    if geom.get("x") is not None and geom.get("y") is not None:
+        gtype, body = _WKB_POINT, struct.pack("<dd", geom["x"], geom["y"])
+    elif geom.get("points"):
+        pts = geom["points"]
+        gtype = _WKB_MULTIPOINT
+        body = struct.pack("<I", len(pts)) + b"".join(
+            struct.pack("<BIdd", 1, _WKB_POINT, p[0], p[1]) for p in pts
+        )
+    elif geom.get("paths"):
+        paths = geom["paths"]
+        gtype = _WKB_MULTILINESTRING
+        body = struct.pack("<I", len(paths)) + b"".join(
+            struct.pack("<BI", 1, _WKB_LINESTRING) + _wkb_coords(p) for p in paths
+        )
+    elif geom.get("rings"):
+        polygons = _group_rings(geom["rings"])
+        if len(polygons) == 1:
+            gtype, body = _WKB_POLYGON, _wkb_rings(polygons[0])
+        else:
+            gtype = _WKB_MULTIPOLYGON
+            body = struct.pack("<I", len(polygons)) + b"".join(
+                struct.pack("<BI", 1, _WKB_POLYGON) + _wkb_rings(p) for p in polygons
+            )
+    else:
+        return None
+    return (struct.pack("<BII", 1, gtype | _EWKB_SRID_FLAG, srid) + body).hex()
+
+
 # ──────────────────────────────────────────────────────────────
 # HTTP helpers
 # ──────────────────────────────────────────────────────────────
 
-def _get_json(url: str, retry: int = 0) -> dict:
+# Shared by all page workers: caps aggregate QPS against the SITG server
+_PAGE_PACER = RateLimiter(MAX_PAGE_RATE)
+
+# One keep-alive connection pool for every ArcGIS request (pages fetched
+# concurrently share it); retries stay in _get_json / _fetch_page (max_retries=0)
+_SESSION = requests.Session()
+for _scheme in ("http://", "https://"):
+    _SESSION.mount(_scheme, HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
+
+
+@contextlib.contextmanager
+def _open_body(
+    url: str, use_cache: bool = True, pacer: RateLimiter | None = None
+) -> Iterator[io.BufferedReader]:
+    """GET `url` and yield its (decoded) body as a buffered binary stream.
+
+    Without a cache the body streams straight off the socket.  With
+    SITG_CACHE_DIR set it is served from, or first written to, the cache:
+    fresh entries skip the request, stale ones are revalidated (304 → reuse).
+    ArcGIS error bodies are never cached.  `pacer`, if given, is waited on
+    before each request that goes to the network (cache hits skip it).
+    """
+    if not (use_cache and CACHE_DIR):
+        if pacer:
+            pacer.wait()
+        with _SESSION.get(url, timeout=120, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            r.raw.auto_close = False  # BufferedReader must see EOF, not a closed file
+            yield io.BufferedReader(r.raw, buffer_size=65536)
+        return
+
+    cache = Path(CACHE_DIR)
+    path = cache / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+    meta_path = path.with_suffix(".meta")
+    headers = {}
+    if path.exists():
+        if time.time() - path.stat().st_mtime < CACHE_TTL:
+            with open(path, "rb") as f:
+                yield f
+            return
+        meta = orjson.loads(meta_path.read_bytes()) if meta_path.exists() else {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    if pacer:
+        pacer.wait()
+    with _SESSION.get(url, headers=headers, timeout=120, stream=True) as r:
+        if r.status_code == 304 and headers:
+            path.touch()
+        else:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            cache.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache, suffix=".part", delete=False) as tmp:
+                for chunk in iter(lambda: r.raw.read(65536), b""):
+                    tmp.write(chunk)
+            with open(tmp.name, "rb") as f:
+                if _ERROR_BODY_RE.match(f.read(64)):
+                    # Hand the error to the caller, but don't keep it
+                    f.seek(0)
+                    try:
+                        yield f
+                    finally:
+                        f.close()
+                        os.unlink(tmp.name)
+                    return
+            os.replace(tmp.name, path)
+            meta_path.write_bytes(orjson.dumps({
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }))
+
+    with open(path, "rb") as f:
+        yield f
+
+
+def _get_json(url: str, use_cache: bool = True) -> dict:
     """GET JSON with retry and exponential backoff."""
-    try:
-        r = requests.get(url, timeout=120)
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        if retry >= MAX_RETRIES:
-            raise
-        wait = RETRY_BACKOFF ** (retry + 1)
-        print(f"    Request error ({e}), retrying in {wait}s ({retry + 1}/{MAX_RETRIES})")
-        time.sleep(wait)
-        return _get_json(url, retry=retry + 1)
+    for attempt in range(MAX_RETRIES):
+        try:
+            with _open_body(url, use_cache) as body:
+                return orjson.loads(body.read())
+        except Exception as e:
+            wait = RETRY_BACKOFF ** (attempt + 1)
+            log(f"    Request error ({e}), retrying in {wait}s ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(wait)
+
+    # Last attempt: errors propagate to the caller
+    with _open_body(url, use_cache) as body:
+        return orjson.loads(body.read())
 
 
 # ──────────────────────────────────────────────────────────────
 # Public API
 # ──────────────────────────────────────────────────────────────
 
-def get_record_count(base_url: str) -> int:
+def get_record_count(base_url: str, use_cache: bool = True) -> int:
     """Get total record count from an ArcGIS Feature Service layer."""
-    url = f"{base_url}/query?where=1%3D1&returnCountOnly=true&f=json"
-    data = _get_json(url)
+    url = f"{base_url}/query?" + urlencode({"where": "1=1", "returnCountOnly": "true", "f": "json"})
+    data = _get_json(url, use_cache=use_cache)
     count = data.get("count")
     if count is None:
         raise RuntimeError(
-            f"ArcGIS API did not return a count.  Response: {json.dumps(data)[:500]}"
+            "ArcGIS API did not return a count.  Response: "
+            + orjson.dumps(data)[:500].decode(errors="replace")
         )
     return count
 
 
-def fetch_all_features(
+def _parse_feature(
+    feat: dict, include_geometry: bool, snake: dict[tuple, tuple], raw_geometry: bool = False
+) -> dict | None:
+    """Convert one ArcGIS feature into a flat snake_case record (None if empty).
+
+    `snake` maps a field-name tuple → its snake_case tuple and is shared
+    across a page; features of a layer almost always share one key layout,
+    so the names are resolved once and each record is built by zip().
+    """
+    attrs = feat.get("attributes")
+    if not attrs:
+        return None
+
+    # Convert keys to snake_case + normalise values
+    keys = tuple(attrs)
+    snake_keys = snake.get(keys)
+    if snake_keys is None:
+        snake_keys = snake[keys] = tuple(map(key_to_snake_case, keys))
+    record = dict(zip(snake_keys, map(format_value, attrs.values())))
+
+    # Include geometry as compact JSON string (orjson: no padding, and far
+    # faster than json on long coordinate arrays), or as the parsed dict
+    if include_geometry and feat.get("geometry"):
+        geom = feat["geometry"]
+        record["geometry"] = geom if raw_geometry else orjson.dumps(geom).decode()
+
+    return record
+
+
+def _page_query_url(base_url: str, page_size: int, include_geometry: bool, out_sr: int) -> str:
+    """Query URL with every parameter but resultOffset (built once per layer)."""
+    params = {
+        "where": "1=1",
+        "outFields": "*",
+        "returnGeometry": "true" if include_geometry else "false",
+        "outSR": out_sr,
+        "resultRecordCount": page_size,
+        "f": "json",
+    }
+    return f"{base_url}/query?" + urlencode(params, safe="*")
+
+
+def _fetch_page(
+    query_url: str,
+    offset: int,
+    include_geometry: bool,
+    use_cache: bool = True,
+    raw_geometry: bool = False,
+) -> tuple[int, list[dict]]:
+    """Fetch + parse one ArcGIS page (runs in a worker thread).
+
+    `query_url` comes from _page_query_url(); the page's offset is appended.
+    Returns (features on the page, parsed records).  Features are parsed as
+    the body streams in (ijson), so a page's raw JSON is never held whole.
+    """
+    url = f"{query_url}&resultOffset={offset}"
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with _open_body(url, use_cache, _PAGE_PACER) as body:
+                # ArcGIS-level error: HTTP 200 with a tiny {"error": {...}} body
+                if _ERROR_BODY_RE.match(body.peek(64)):
+                    err = orjson.loads(body.read()).get("error") or {}
+                    break
+
+                snake: dict[tuple, tuple] = {}
+                count = 0
+                records: list[dict] = []
+                for feat in ijson.items(body, "features.item", use_float=True):
+                    count += 1
+                    record = _parse_feature(feat, include_geometry, snake, raw_geometry)
+                    if record is not None:
+                        records.append(record)
+                return count, records
+        except Exception as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            wait = RETRY_BACKOFF ** (attempt + 1)
+            log(f"    Request error ({e}), retrying in {wait}s ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(wait)
+
+    raise RuntimeError(
+        f"ArcGIS API error {err.get('code')}: {err.get('message')}"
+    )
+
+
+def iter_features(
     base_url: str,
     include_geometry: bool = True,
     out_sr: int = 4326,
     page_size: int = PAGE_SIZE,
-) -> list[dict]:
+    concurrent_pages: int = CONCURRENT_PAGES,
+    use_cache: bool = True,
+    raw_geometry: bool = False,
+) -> Iterator[list[dict]]:
     """
-    Fetch ALL features from an ArcGIS REST Feature Service, paginated.
-
-    Args:
-        base_url:          Layer URL (e.g. .../FeatureServer/0)
-        include_geometry:  Include geometry in output (default True)
-        out_sr:            Output spatial reference (default 4326 = WGS84)
-        page_size:         Records per page (default 2000, ArcGIS max)
+    Stream ALL features from an ArcGIS REST Feature Service, one page at a time.
 
-    Returns:
-        List of dicts with snake_case keys.
-        If include_geometry=True, each dict has a 'geometry' key with
-        the raw ArcGIS geometry as a JSON string.
+    Same arguments as fetch_all_features().  Yields one list of records per
+    ArcGIS page, in offset order, so callers can upsert as pages arrive
+    instead of holding the whole layer in memory.  Up to `concurrent_pages`
+    later pages are fetched in the background while the caller works.
     """
-    count = get_record_count(base_url)
+    count = get_record_count(base_url, use_cache)
     if not count:
-        print("  WARNING: ArcGIS API returned 0 records")
-        return []
+        log("  WARNING: ArcGIS API returned 0 records")
+        return
 
-    print(f"  Total records in API: {count:,}")
+    log(f"  Total records in API: {count:,}")
 
-    all_records: list[dict] = []
-    offsets = list(range(0, count, page_size))
-    total_pages = len(offsets)
-
-    for page_num, offset in enumerate(offsets, 1):
-        geom_flag = "true" if include_geometry else "false"
-        url = (
-            f"{base_url}/query?where=1%3D1&outFields=*"
-            f"&returnGeometry={geom_flag}&outSR={out_sr}"
-            f"&resultOffset={offset}&resultRecordCount={page_size}&f=json"
-        )
+    fetched = 0
+    offsets = iter(range(0, count, page_size))
+    total_pages = -(-count // page_size)
+    query_url = _page_query_url(base_url, page_size, include_geometry, out_sr)
 
-        data = _get_json(url)
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrent_pages))
+    pending: deque = deque()
 
-        # Check for ArcGIS-level error
-        if "error" in data:
-            err = data["error"]
-            raise RuntimeError(
-                f"ArcGIS API error {err.get('code')}: {err.get('message')}"
-            )
+    def submit_next() -> None:
+        offset = next(offsets, None)
+        if offset is not None:
+            pending.append(submit(
+                pool, _fetch_page, query_url, offset, include_geometry, use_cache, raw_geometry
+            ))
 
-        features = data.get("features", [])
-        if not features:
-            break
+    try:
+        for _ in range(max(1, concurrent_pages)):
+            submit_next()
 
-        for feat in features:
-            attrs = feat.get("attributes")
-            if not attrs:
-                continue
+        page_num = 0
+        while pending:
+            n_features, records = pending.popleft().result()
+            if not n_features:
+                break
+            submit_next()
+            page_num += 1
 
-            # Convert keys to snake_case + normalise values
-            record: dict = {}
-            for k, v in attrs.items():
-                record[key_to_snake_case(k)] = format_value(v)
+            fetched += len(records)
 
-            # Include geometry as JSON string
-            if include_geometry and feat.get("geometry"):
-                record["geometry"] = json.dumps(feat["geometry"])
+            if page_num % 10 == 0 or page_num == 1 or page_num == total_pages:
+                log(f"  Page {page_num}/{total_pages}: {fetched:,} records fetched")
 
-            all_records.append(record)
+            yield records
+    finally:
+        # Early exit (empty page, error, caller stopped): drop queued pages
+        pool.shutdown(wait=False, cancel_futures=True)
 
-        if page_num % 10 == 0 or page_num == 1 or page_num == total_pages:
-            print(f"  Page {page_num}/{total_pages}: {len(all_records):,} records fetched")
+    log(f"  Fetch complete: {fetched:,} records")
 
-        # Small delay between pages to be respectful
-        time.sleep(0.1)
 
-    print(f"  Fetch complete: {len(all_records):,} records")
+def fetch_all_features(
+    base_url: str,
+    include_geometry: bool = True,
+    out_sr: int = 4326,
+    page_size: int = PAGE_SIZE,
+    concurrent_pages: int = CONCURRENT_PAGES,
+    use_cache: bool = True,
+    raw_geometry: bool = False,
+) -> list[dict]:
+    """
+    Fetch ALL features from an ArcGIS REST Feature Service, paginated.
+
+    Args:
+        base_url:          Layer URL (e.g. .../FeatureServer/0)
+        include_geometry:  Include geometry in output (default True)
+        out_sr:            Output spatial reference (default 4326 = WGS84)
+        page_size:         Records per page (default 2000, ArcGIS max)
+        concurrent_pages:  Pages fetched in parallel (default 4; 1 = sequential)
+        use_cache:         Use the SITG_CACHE_DIR disk cache when it is set
+                           (default True; False always fetches fresh)
+        raw_geometry:      Keep geometries as parsed EsriJSON dicts instead
+                           of JSON strings (default False), e.g. to feed
+                           esri_to_ewkb_hex() without re-parsing
+
+    Returns:
+        List of dicts with snake_case keys.
+        If include_geometry=True, each dict has a 'geometry' key with
+        the raw ArcGIS geometry as a JSON string (a dict with raw_geometry).
+    """
+    all_records: list[dict] = []
+    for page in iter_features(
+        base_url, include_geometry, out_sr, page_size, concurrent_pages, use_cache,
+        raw_geometry,
+    ):
+        all_records.extend(page)
     return all_records
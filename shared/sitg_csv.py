@@ -4,17 +4,20 @@ Reusable helper for SITG CSV ZIP data downloads.
 Handles:
   - Download ZIP file from SITG open data
   - Extract CSV from ZIP
-  - Parse CSV with semicolon delimiter
+  - Parse CSV with semicolon delimiter (Arrow's native reader, block by block)
   - Field name mapping (to snake_case, matching existing JS parsers)
   - Value normalisation (stringify + whitespace collapse)
 
 Usage:
-    from shared.sitg_csv import fetch_csv_features
+    from shared.sitg_csv import fetch_csv_features, iter_csv_features
 
     records = fetch_csv_features(
         csv_url="https://ge.ch/sitg/geodata/SITG/OPENDATA/CAD_DDP-CSV.zip",
     )
 
+    # Or stream row by row (batch_upsert takes the iterator as-is):
+    batch_upsert(..., records=iter_csv_features(csv_url), ...)
+
 Each record is a dict with snake_case keys matching the existing bronze table
 columns (produced by the legacy JS parsers).  CSV sources do NOT include
 geometry — use the ArcGIS helper if geometry is needed.
@@ -22,12 +25,129 @@ geometry — use the ArcGIS helper if geometry is needed.
 
 import csv
 import io
+import shutil
+import tempfile
 import zipfile
+from typing import Iterator
 
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import requests
+from requests.adapters import HTTPAdapter
 
 from shared.sitg_arcgis import key_to_snake_case, format_value
 
+DOWNLOAD_CHUNK = 1 << 20  # bytes copied to the temp file per read
+
+# Every character Python's str.isspace() accepts (= the \s that
+# format_value() collapses), spelled for Arrow's RE2
+_WS_PATTERN = r"[\t-\r\x{1c}-\x{1f}\x{85}\p{Z}]+"
+
+
+def _format_column(values: pa.Array) -> list:
+    """format_value() over a whole string column, in Arrow."""
+    values = pc.utf8_trim(pc.replace_substring_regex(values, _WS_PATTERN, " "), " ")
+    return pc.if_else(pc.equal(values, ""), None, values).to_pylist()
+
+
+def _csv_header(zf: zipfile.ZipFile, csv_name: str) -> list[str]:
+    """First row of the CSV (utf-8-sig: a BOM is dropped); [] if empty."""
+    with zf.open(csv_name) as f:
+        text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        return next(csv.reader(text, delimiter=";"), [])
+
+
+# Keep-alive connection pool for the ZIP downloads (no urllib3 retries)
+_SESSION = requests.Session()
+for _scheme in ("http://", "https://"):
+    _SESSION.mount(_scheme, HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
+
+
+def iter_csv_features(csv_url: str) -> Iterator[dict]:
+    """
+    Download a SITG CSV ZIP and yield its records one at a time.
+
+    Same argument as fetch_csv_features().  Rows are parsed as the caller
+    consumes them, so only the records the caller keeps are held in memory
+    (the ZIP itself is spooled to disk).
+
+    Records come in file order, except rows Arrow rejects (wrong field
+    count): those are re-parsed with the csv module and yielded right after
+    the block (~1 MB) they were found in, not at their original position.
+    """
+    print(f"  Downloading CSV ZIP...")
+    # Spool the ZIP to an anonymous temp file (ZipFile needs random access)
+    # instead of holding the whole archive in memory next to the records.
+    with _SESSION.get(csv_url, timeout=300, stream=True) as resp, \
+            tempfile.TemporaryFile() as tmp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        shutil.copyfileobj(resp.raw, tmp, DOWNLOAD_CHUNK)
+        print(f"  Download complete: {tmp.tell() / 1024 / 1024:.1f} MB")
+        tmp.seek(0)
+
+        with zipfile.ZipFile(tmp) as zf:
+            # Find the CSV file inside the ZIP
+            csv_names = [n for n in zf.namelist() if n.lower().endswith(".csv")]
+            if not csv_names:
+                raise RuntimeError(f"No CSV file found in ZIP. Contents: {zf.namelist()}")
+
+            csv_name = csv_names[0]
+            print(f"  Extracting: {csv_name}")
+
+            # Header resolved once with csv (keeps quoting rules identical);
+            # the body then goes through Arrow as all-string columns under
+            # positional names, zipped back against the snake_case header
+            # (a repeated column keeps its last value, as with DictReader)
+            snake_keys = tuple(map(key_to_snake_case, _csv_header(zf, csv_name)))
+            width = len(snake_keys)
+            if not width:
+                print("  CSV records: 0")
+                return
+
+            # Rows with the wrong field count are handed back by Arrow and
+            # parsed with csv instead, as before: overlong rows are cut,
+            # short ones padded with None
+            invalid: list[str] = []
+
+            def on_invalid(row) -> str:
+                invalid.append(row.text)
+                return "skip"
+
+            def drain_invalid() -> Iterator[dict]:
+                for row in csv.reader(invalid, delimiter=";"):
+                    if row:
+                        row += [None] * (width - len(row))
+                        yield dict(zip(snake_keys, map(format_value, row)))
+                invalid.clear()
+
+            names = [f"c{i}" for i in range(width)]
+            n_records = 0
+            with zf.open(csv_name) as f:
+                reader = pa_csv.open_csv(
+                    f,
+                    read_options=pa_csv.ReadOptions(skip_rows=1, column_names=names),
+                    parse_options=pa_csv.ParseOptions(
+                        delimiter=";", newlines_in_values=True, invalid_row_handler=on_invalid
+                    ),
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types={n: pa.string() for n in names}
+                    ),
+                )
+                for batch in reader:
+                    for row in zip(*map(_format_column, batch.columns)):
+                        yield dict(zip(snake_keys, row))
+                    n_records += batch.num_rows
+                    for record in drain_invalid():
+                        yield record
+                        n_records += 1
+                for record in drain_invalid():
+                    yield record
+                    n_records += 1
+
+    print(f"  CSV records: {n_records:,}")
+
 
 def fetch_csv_features(csv_url: str) -> list[dict]:
     """
@@ -37,37 +157,7 @@ def fetch_csv_features(csv_url: str) -> list[dict]:
         csv_url: URL to the CSV ZIP file (e.g. .../CAD_DDP-CSV.zip)
 
     Returns:
-        List of dicts with snake_case keys and normalised values.
+        List of dicts with snake_case keys and normalised values, in
+        file order except for malformed rows (see iter_csv_features()).
     """
-    print(f"  Downloading CSV ZIP...")
-    resp = requests.get(csv_url, timeout=300, stream=True)
-    resp.raise_for_status()
-
-    content = resp.content
-    print(f"  Download complete: {len(content) / 1024 / 1024:.1f} MB")
-
-    with zipfile.ZipFile(io.BytesIO(content)) as zf:
-        # Find the CSV file inside the ZIP
-        csv_names = [n for n in zf.namelist() if n.lower().endswith(".csv")]
-        if not csv_names:
-            raise RuntimeError(f"No CSV file found in ZIP. Contents: {zf.namelist()}")
-
-        csv_name = csv_names[0]
-        print(f"  Extracting: {csv_name}")
-
-        with zf.open(csv_name) as f:
-            # Use utf-8-sig to handle BOM if present
-            text = io.TextIOWrapper(f, encoding="utf-8-sig")
-            reader = csv.DictReader(text, delimiter=";")
-
-            records: list[dict] = []
-            for row in reader:
-                record: dict = {}
-                for k, v in row.items():
-                    if k is None:
-                        continue
-                    record[key_to_snake_case(k)] = format_value(v)
-                records.append(record)
-
-    print(f"  CSV records: {len(records):,}")
-    return records
+    return list(iter_csv_features(csv_url))
@@ -11,8 +11,12 @@ Usage:
         records=records,
         conflict_column="uid",
         schema="bronze",       # optional, defaults to "public"
+        max_workers=4,         # optional, concurrent batch requests
     )
 
+    # records may also be any iterable (e.g. a generator): batches are cut
+    # from it as they are sent, so the full row set is never materialised.
+
     # Dual-write to lamap_db (primary) + re-LLM (mirror):
     from shared.supabase_client import dual_batch_upsert
 
@@ -24,22 +28,65 @@ Usage:
     )
 """
 
+import gzip
 import os
 import sys
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain, islice
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+from shared.log_prefix import log, submit
+from shared.rate_limit import RateLimiter
 
 MAX_RETRIES = 3
+DEFAULT_MAX_WORKERS = 4  # concurrent batches per batch_upsert call
 RETRY_BACKOFF_BASE = 2  # seconds: 2, 4, 8
+RETRY_AFTER_MAX = 60  # cap on a server-sent Retry-After (seconds)
+
+# Upsert POSTs started per second, across all workers and destinations
+# (UPSERT_MAX_RATE overrides; 0 = unpaced).  Backpressure beyond that comes
+# from the server: 429s are retried after their Retry-After.
+_RATE = RateLimiter(float(os.environ.get("UPSERT_MAX_RATE", "50")))
+
+# batch_size=None: size batches to ~TARGET_BATCH_BYTES of JSON, within bounds
+TARGET_BATCH_BYTES = 8_000_000
+MIN_BATCH_SIZE = 50
+# Halvings allowed for a batch that times out (413s always split down to
+# MIN_BATCH_SIZE): a slow batch may be too big, but a dead server isn't
+MAX_TIMEOUT_SPLITS = 2
+MAX_BATCH_SIZE = 10_000
+
+# Upsert bodies at least this big are sent gzip'd (level 1: the JSON is
+# repetitive text, so even the fastest level shrinks it several-fold).
+# Projects whose gateway rejects compressed bodies (400/415) are remembered
+# here and get plain JSON for the rest of the run.
+GZIP_MIN_BYTES = 16_384
+_NO_GZIP = set()
+
+# One keep-alive connection pool for every upsert POST (concurrent batches
+# included), so each batch skips the TCP + TLS handshake.  Retries stay in
+# _post_batch (max_retries=0).  Headers common to every upsert live on the
+# session; _build_headers() adds the per-call credentials and profile.
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "Content-Type": "application/json",
+    # return=minimal: only the status is checked, so don't have PostgREST
+    # serialise the upserted rows back
+    "Prefer": "resolution=merge-duplicates,return=minimal",
+})
+for _scheme in ("http://", "https://"):
+    _SESSION.mount(_scheme, HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
 
 
 def _build_headers(key, schema="public"):
-    """Build Supabase REST headers with correct schema profile."""
+    """Build per-call Supabase REST headers (credentials + schema profile)."""
     headers = {
         "apikey": key,
         "Authorization": f"Bearer {key}",
-        "Content-Type": "application/json",
-        "Prefer": "resolution=merge-duplicates",
     }
     # For non-public schemas, PostgREST needs Content-Profile on writes
     if schema and schema != "public":
@@ -47,46 +94,166 @@ def _build_headers(key, schema="public"):
     return headers
 
 
-def _upsert_single_batch(url, key, table, records, conflict_column, schema="public"):
-    """Upsert one batch with retry logic. Returns number of rows upserted."""
-    endpoint = f"{url.rstrip('/')}/rest/v1/{table}?on_conflict={conflict_column}"
+def _retry_after(r):
+    """Seconds asked for by a 429's Retry-After header (None if absent/unparsable)."""
+    try:
+        return min(RETRY_AFTER_MAX, max(0.0, float(r.headers.get("Retry-After", ""))))
+    except ValueError:
+        return None
+
+
+def _auto_batch_size(records):
+    """Pick a batch size that keeps each POST body near TARGET_BATCH_BYTES."""
+    sample = records[:20]
+    avg_bytes = max(1, len(orjson.dumps(sample)) // len(sample))
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, TARGET_BATCH_BYTES // avg_bytes))
+
+
+def dedupe_records(records, conflict_column):
+    """Keep the last record per conflict key (first-seen order), as a list.
+
+    PostgREST rejects a batch that would update the same row twice
+    (21000 "ON CONFLICT DO UPDATE command cannot affect row a second
+    time").  Composite keys ("a,b") compare as tuples; a NULL key part
+    never conflicts, so those records are all kept.
+    """
+    columns = [c.strip() for c in conflict_column.split(",")]
+    if len(columns) == 1:
+        column = columns[0]
+        keyed = ((r.get(column), r) for r in records)
+    else:
+        keyed = ((tuple(map(r.get, columns)), r) for r in records)
+
+    unique = {}
+    n_records = 0
+    for k, r in keyed:
+        n_records += 1
+        if k is None or (type(k) is tuple and None in k):
+            k = object()
+        unique[k] = r
+
+    if len(unique) < n_records:
+        log(f"    Deduped {n_records - len(unique):,} duplicate {conflict_column} keys")
+    return list(unique.values())
+
+
+def _upsert_single_batch(
+    url, key, table, records, conflict_column, schema="public", split=False, depth=0
+):
+    """Upsert one batch with retry logic. Returns number of rows upserted.
+
+    With split=True, a batch rejected as too large (413) is halved and each
+    half retried, down to MIN_BATCH_SIZE.  A batch that keeps timing out
+    (client timeout, or a statement timeout from Postgres) is halved at
+    most MAX_TIMEOUT_SPLITS times, and abandoned as soon as the first half
+    fails too — splitting didn't help, so the server is the problem.
+    """
+    count, reason = _post_batch(url, key, table, records, conflict_column, schema)
+    if not split or reason is None or len(records) <= MIN_BATCH_SIZE:
+        return count
+    if reason == "slow" and depth >= MAX_TIMEOUT_SPLITS:
+        log(f"    Giving up on batch of {len(records)} rows (still timing out after splitting)")
+        return count
+
+    mid = len(records) // 2
+    log(f"    Splitting batch of {len(records)} rows into {mid} + {len(records) - mid}")
+    first = _upsert_single_batch(
+        url, key, table, records[:mid], conflict_column, schema, split, depth + 1
+    )
+    if reason == "slow" and not first:
+        log(f"    Splitting didn't help, giving up on the other {len(records) - mid} rows")
+        return first
+    return first + _upsert_single_batch(
+        url, key, table, records[mid:], conflict_column, schema, split, depth + 1
+    )
+
+
+def _post_batch(url, key, table, records, conflict_column, schema="public"):
+    """POST one batch with retry logic.
+
+    Returns (rows upserted, split reason) — the reason is set when the
+    batch failed in a way a smaller batch might not: "size" for a 413,
+    "slow" when retries ran out on timeouts or Postgres statement timeouts
+    (57014).  Other failures (plain 5xx, connection errors, 4xx) give None.
+    """
+    base = url.rstrip("/")
+    endpoint = f"{base}/rest/v1/{table}?on_conflict={conflict_column}"
     headers = _build_headers(key, schema)
+    # Encode (and compress) once, not on every retry; Content-Type is set above
+    body = orjson.dumps(records)
+    compressed = len(body) >= GZIP_MIN_BYTES and base not in _NO_GZIP
+    if compressed:
+        body = gzip.compress(body, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    split_reason = None
 
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            r = requests.post(endpoint, headers=headers, json=records, timeout=30)
+            _RATE.wait()
+            r = _SESSION.post(endpoint, headers=headers, data=body, timeout=30)
+            if compressed and r.status_code in (400, 415):
+                # 415 is the gateway refusing gzip.  A 400 may just as well
+                # be a data error (unknown column, bad type...), so gzip is
+                # only blamed if the same batch goes through as plain JSON;
+                # otherwise the original error stands and gzip stays on.
+                plain = orjson.dumps(records)
+                plain_headers = {k: v for k, v in headers.items() if k != "Content-Encoding"}
+                _RATE.wait()
+                r_plain = _SESSION.post(endpoint, headers=plain_headers, data=plain, timeout=30)
+                if r.status_code == 415 or r_plain.status_code in (200, 201):
+                    log(f"    Compressed body rejected ({r.status_code}), sending plain JSON from now on")
+                    _NO_GZIP.add(base)
+                    compressed = False
+                    body, headers, r = plain, plain_headers, r_plain
             if r.status_code in (200, 201):
-                return len(records)
+                return len(records), None
+            elif r.status_code == 413:
+                log(f"    Payload too large ({len(body):,} bytes, {len(records)} rows)")
+                return 0, "size"
             elif r.status_code == 429:
-                wait = RETRY_BACKOFF_BASE ** attempt
-                print(f"    Rate limited, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+                wait = _retry_after(r)
+                if wait is None:
+                    wait = RETRY_BACKOFF_BASE ** attempt
+                log(f"    Rate limited, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+                split_reason = None
                 time.sleep(wait)
                 continue
             elif r.status_code >= 500:
                 wait = RETRY_BACKOFF_BASE ** attempt
-                print(f"    Server error {r.status_code}, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+                log(f"    Server error {r.status_code}, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
                 if attempt == 1:
-                    print(f"    Response: {r.text[:500]}")
+                    log(f"    Response: {r.text[:500]}")
+                split_reason = "slow" if "57014" in r.text else None
                 time.sleep(wait)
                 continue
             else:
                 # Client error (4xx) - don't retry
-                print(f"    ERROR {r.status_code}: {r.text[:300]}")
-                return 0
+                log(f"    ERROR {r.status_code}: {r.text[:300]}")
+                return 0, None
         except requests.exceptions.Timeout:
             wait = RETRY_BACKOFF_BASE ** attempt
-            print(f"    Timeout, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+            log(f"    Timeout, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+            split_reason = "slow"
             time.sleep(wait)
         except requests.exceptions.RequestException as e:
             wait = RETRY_BACKOFF_BASE ** attempt
-            print(f"    Request error: {e}, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+            log(f"    Request error: {e}, retrying in {wait}s (attempt {attempt}/{MAX_RETRIES})")
+            split_reason = None
             time.sleep(wait)
 
-    print(f"    FAILED after {MAX_RETRIES} attempts")
-    return 0
+    log(f"    FAILED after {MAX_RETRIES} attempts")
+    return 0, split_reason
+
 
+def _log_batch(batch_num, total_batches, count, size):
+    status = "OK" if count > 0 else "FAIL"
+    of_total = f"/{total_batches}" if total_batches else ""
+    log(f"    Batch {batch_num}{of_total}: {count}/{size} rows [{status}]")
 
-def batch_upsert(url, key, table, records, conflict_column, schema="public", batch_size=500):
+
+def batch_upsert(
+    url, key, table, records, conflict_column, schema="public", batch_size=2000, max_workers=None
+):
     """
     Upsert records into a Supabase table in batches.
 
@@ -94,35 +261,96 @@ def batch_upsert(url, key, table, records, conflict_column, schema="public", bat
         url:              Supabase project URL (e.g. "https://xxxx.supabase.co")
         key:              Supabase service_role key
         table:            Target table name (e.g. "zefix_companies")
-        records:          List of dicts to upsert
+        records:          Dicts to upsert: a list, or any iterable (a
+                          generator is consumed batch by batch, with at
+                          most ~2 batches per worker held at once).
+                          Records sharing a conflict key are deduped (last
+                          one wins) — across a list, or within each batch
+                          of an iterable.
         conflict_column:  Column for ON CONFLICT (e.g. "uid")
         schema:           Target schema (default "public"). Non-public schemas
                           use Content-Profile header for PostgREST routing.
-        batch_size:       Records per batch (default 500)
+        batch_size:       Records per batch (default 2000).  None sizes
+                          batches from the payload (~8 MB of JSON each,
+                          50-10,000 rows) and splits any batch that is
+                          rejected as too large (413), or — a bounded
+                          number of times — keeps timing out.
+        max_workers:      Batches in flight at once.  Defaults to the
+                          UPSERT_MAX_WORKERS env var, else 4; 1 = sequential.
+                          Batch results are logged in batch order.
 
     Returns:
         Total number of rows successfully upserted.
+
+    Raises:
+        RuntimeError: url or key is empty (a configuration error, not a
+                      failed upsert — callers validate their env up front).
     """
     if not url or not key:
-        print("ERROR: url and key are required")
-        return 0
+        raise RuntimeError(f"batch_upsert({table}): url and key are required")
 
     if not records:
         return 0
 
+    if max_workers is None:
+        max_workers = int(os.environ.get("UPSERT_MAX_WORKERS", str(DEFAULT_MAX_WORKERS)))
+
+    sized = hasattr(records, "__len__")
+    if sized and conflict_column:
+        records = dedupe_records(records, conflict_column)
+
+    rows = iter(records)
+    split = batch_size is None
+    if split:
+        head = list(islice(rows, 20))
+        if not head:
+            return 0
+        batch_size = _auto_batch_size(head)
+        log(f"    Auto batch size: {batch_size:,} rows")
+        rows = chain(head, rows)
+
+    # Batches are cut lazily; the total is only known for sized inputs
+    batches = iter(lambda: list(islice(rows, batch_size)), [])
+    if not sized and conflict_column:
+        batches = (dedupe_records(batch, conflict_column) for batch in batches)
+    total_batches = -(-len(records) // batch_size) if sized else None
     total_upserted = 0
-    total_batches = (len(records) + batch_size - 1) // batch_size
 
-    for i in range(0, len(records), batch_size):
-        batch = records[i : i + batch_size]
-        batch_num = i // batch_size + 1
-        count = _upsert_single_batch(url, key, table, batch, conflict_column, schema)
-        total_upserted += count
-
-        status = "OK" if count > 0 else "FAIL"
-        print(f"    Batch {batch_num}/{total_batches}: {count}/{len(batch)} rows [{status}]")
-
-        time.sleep(0.3)
+    if max_workers <= 1 or total_batches == 1:
+        for batch_num, batch in enumerate(batches, 1):
+            count = _upsert_single_batch(url, key, table, batch, conflict_column, schema, split)
+            total_upserted += count
+            _log_batch(batch_num, total_batches, count, len(batch))
+
+        return total_upserted
+
+    # Concurrent: overlap network round trips with server-side commits.
+    # At most 2 batches per worker are cut ahead; results are logged in
+    # batch order as soon as each prefix is complete.
+    futures = {}
+    done = {}
+    next_log = 1
+
+    def collect(finished):
+        nonlocal total_upserted, next_log
+        for future in finished:
+            batch_num, size = futures.pop(future)
+            count = future.result()
+            total_upserted += count
+            done[batch_num] = (count, size)
+        while next_log in done:
+            _log_batch(next_log, total_batches, *done.pop(next_log))
+            next_log += 1
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for batch_num, batch in enumerate(batches, 1):
+            if len(futures) >= 2 * max_workers:
+                collect(wait(futures, return_when=FIRST_COMPLETED).done)
+            future = submit(
+                pool, _upsert_single_batch, url, key, table, batch, conflict_column, schema, split
+            )
+            futures[future] = (batch_num, len(batch))
+        collect(wait(futures).done)
 
     return total_upserted
 
@@ -135,7 +363,7 @@ def dual_batch_upsert(
     conflict_column,
     schema_lamap=None,
     schema_rellm=None,
-    batch_size=500,
+    batch_size=2000,
 ):
     """
     Two-target UPSERT: writes to lamap_db (PRIMARY) then mirrors to re-LLM (SECONDARY).
@@ -167,15 +395,20 @@ def dual_batch_upsert(
 
     Returns:
         int — rows upserted into the PRIMARY (lamap_db) target.
+
+    Raises:
+        RuntimeError: PRIMARY credentials are missing from the environment.
     """
     lamap_url = os.environ.get("LAMAP_SUPABASE_URL", "")
     lamap_key = os.environ.get("LAMAP_SUPABASE_SERVICE_KEY", "")
+    if not lamap_url or not lamap_key:
+        raise RuntimeError("LAMAP_SUPABASE_URL and LAMAP_SUPABASE_SERVICE_KEY are required")
     rellm_url = os.environ.get("RE_LLM_SUPABASE_URL", "")
     rellm_key = os.environ.get("RE_LLM_SUPABASE_SERVICE_ROLE_KEY", "")
     schema_lamap = schema_lamap or os.environ.get("LAMAP_SCHEMA", "bronze")
     schema_rellm = schema_rellm or os.environ.get("RE_LLM_SCHEMA", "bronze_ch")
 
-    print(f"  [PRIMARY] lamap_db {schema_lamap}.{table_lamap} ← {len(records):,} rows")
+    log(f"  [PRIMARY] lamap_db {schema_lamap}.{table_lamap} ← {len(records):,} rows")
     primary_count = batch_upsert(
         url=lamap_url,
         key=lamap_key,
@@ -187,14 +420,14 @@ def dual_batch_upsert(
     )
 
     if not rellm_url or not rellm_key:
-        print(
+        log(
             "  [re-LLM dual-write SKIPPED] RE_LLM_SUPABASE_URL or "
             "RE_LLM_SUPABASE_SERVICE_ROLE_KEY not set in env",
             file=sys.stderr,
         )
         return primary_count
 
-    print(f"  [SECONDARY] re-LLM {schema_rellm}.{table_rellm} ← {len(records):,} rows")
+    log(f"  [SECONDARY] re-LLM {schema_rellm}.{table_rellm} ← {len(records):,} rows")
     try:
         mirror_count = batch_upsert(
             url=rellm_url,
@@ -205,11 +438,11 @@ def dual_batch_upsert(
             schema=schema_rellm,
             batch_size=batch_size,
         )
-        print(
+        log(
             f"  [re-LLM dual-write OK] {mirror_count:,} rows mirrored to "
             f"{schema_rellm}.{table_rellm}"
         )
     except Exception as e:
-        print(f"[re-LLM dual-write FAILED] {e}", file=sys.stderr)
+        log(f"[re-LLM dual-write FAILED] {e}", file=sys.stderr)
 
     return primary_count
@@ -0,0 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.log_prefix import log, log_prefix, submit
+
+
+def test_log_without_prefix_is_print(capsys):
+    log("a", 1)
+    assert capsys.readouterr().out == "a 1\n"
+
+
+def test_prefix_on_every_line(capsys):
+    with log_prefix("[T] "):
+        log("\nx")
+    log("y")
+    assert capsys.readouterr().out == "[T] \n[T] x\ny\n"
+
+
+def test_submit_carries_prefix_into_workers(capsys):
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        with log_prefix("[T] "):
+            futures = [submit(pool, log, "worker") for _ in range(2)]
+        futures.append(pool.submit(log, "plain"))
+        for f in futures:
+            f.result()
+    assert sorted(capsys.readouterr().out.splitlines()) == ["[T] worker", "[T] worker", "plain"]
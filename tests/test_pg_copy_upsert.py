@@ -0,0 +1,17 @@
+from shared.pg_copy_upsert import _copy_value
+
+
+def test_copy_value_text_column_keeps_string():
+    assert _copy_value('{"a": 1}') == '{"a": 1}'
+    assert _copy_value({"a": 1}) == '{"a":1}'
+
+
+def test_copy_value_json_column_matches_postgrest():
+    # PostgREST stores a str sent to a jsonb column as a JSON string
+    assert _copy_value('{"a": 1}', json_column=True) == '"{\\\\"a\\\\": 1}"'
+    assert _copy_value({"a": 1}, json_column=True) == '{"a":1}'
+    assert _copy_value(None, json_column=True) == r"\N"
+
+
+def test_copy_value_escapes_copy_specials():
+    assert _copy_value("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
@@ -0,0 +1,28 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+PIPELINE = Path(__file__).parents[1] / "pipelines" / "simap" / "import.py"
+
+
+@pytest.fixture(scope="module")
+def simap():
+    spec = importlib.util.spec_from_file_location("simap_import", PIPELINE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_strip_html_removes_tags(simap):
+    assert simap.strip_html("<p>Travaux</p><p>de&nbsp;génie civil</p>") == "Travaux. de génie civil"
+
+
+def test_strip_html_keeps_bare_less_than(simap):
+    assert simap.strip_html("a<b") == "a<b"
+    assert simap.strip_html("délai < 5 ans") == "délai < 5 ans"
+
+
+def test_strip_html_decodes_entities_without_markup(simap):
+    assert simap.strip_html("Caf&eacute;  &amp; bar") == "Café & bar"
+    assert simap.strip_html("") is None
@@ -0,0 +1,43 @@
+import struct
+
+from shared.sitg_arcgis import esri_to_ewkb_hex
+
+# Esri rings: outer rings clockwise, holes counter-clockwise
+SQUARE = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+HOLE = [[2, 2], [4, 2], [4, 4], [2, 4], [2, 2]]
+ISLAND = [[20, 0], [20, 5], [25, 5], [25, 0], [20, 0]]
+
+
+def header(ewkb_hex):
+    """(geometry type, srid, part count) of a little-endian EWKB."""
+    order, gtype, srid, n = struct.unpack_from("<BIII", bytes.fromhex(ewkb_hex))
+    assert order == 1
+    return gtype & 0xFF, srid, n
+
+
+def test_point():
+    assert header(esri_to_ewkb_hex({"x": 6.1, "y": 46.2}))[:2] == (1, 4326)
+
+
+def test_polygon_with_hole():
+    assert header(esri_to_ewkb_hex({"rings": [SQUARE, HOLE]})) == (3, 4326, 2)
+
+
+def test_polygon_outer_ring_written_first():
+    ewkb = bytes.fromhex(esri_to_ewkb_hex({"rings": [HOLE, SQUARE]}))
+    # First ring: point count, then its first vertex
+    assert struct.unpack_from("<Idd", ewkb, 13) == (5, 0.0, 0.0)
+
+
+def test_several_outer_rings_are_a_multipolygon():
+    ewkb_hex = esri_to_ewkb_hex({"rings": [SQUARE, ISLAND, HOLE]})
+    assert header(ewkb_hex) == (6, 4326, 2)
+
+    ewkb = bytes.fromhex(ewkb_hex)
+    # Part 1 keeps the hole: byte order, type, ring count
+    assert struct.unpack_from("<BII", ewkb, 13) == (1, 3, 2)
+
+
+def test_empty_geometry():
+    assert esri_to_ewkb_hex({"rings": []}) is None
+    assert esri_to_ewkb_hex(None) is None
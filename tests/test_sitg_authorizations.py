@@ -0,0 +1,83 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+import shared.supabase_client as supabase_client
+
+PIPELINE = Path(__file__).parents[1] / "pipelines" / "sitg_authorizations" / "import.py"
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    spec = importlib.util.spec_from_file_location("sitg_authorizations_import", PIPELINE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def state():
+    dest = {"name": "test", "url": "http://db", "key": "k", "schema": "bronze", "dsn": ""}
+    return {
+        "dest": dest,
+        "table": "SIT_AUTOR_DOSSIER",
+        "known_cols": None,
+        "allowed": None,
+        "geom_ewkb": False,
+        "drop": frozenset(),
+        "rows_before": None,
+        "fetched": 0,
+        "upserted": 0,
+        "failed_pages": 0,
+    }
+
+
+def test_duplicate_keys_are_not_a_failed_page(pipeline, state, monkeypatch):
+    posted = []
+
+    def fake_post(url, key, table, records, conflict_column, schema="public"):
+        posted.extend(records)
+        return len(records), None
+
+    monkeypatch.setattr(supabase_client, "_post_batch", fake_post)
+    ds = {"conflict_column": "objectid"}
+    page = [
+        {"objectid": 1, "statut": "old"},
+        {"objectid": 2, "statut": "a"},
+        {"objectid": 1, "statut": "new"},
+    ]
+
+    pipeline.upsert_page(state, ds, page)
+
+    assert state["fetched"] == 3
+    assert state["upserted"] == 2
+    assert state["failed_pages"] == 0
+    assert [r["statut"] for r in posted] == ["new", "a"]
+
+
+def test_short_upsert_is_a_failed_page(pipeline, state, monkeypatch):
+    monkeypatch.setattr(supabase_client, "_post_batch", lambda *a, **k: (0, None))
+    ds = {"conflict_column": "objectid"}
+
+    pipeline.upsert_page(state, ds, [{"objectid": 1}, {"objectid": 2}])
+
+    assert state["failed_pages"] == 1
+
+
+def test_raw_geometry_encoded_per_destination(pipeline, state, monkeypatch):
+    posted = []
+    monkeypatch.setattr(
+        supabase_client, "_post_batch",
+        lambda url, key, table, records, *a, **k: (posted.extend(records) or len(records), None),
+    )
+    ds = {"conflict_column": "objectid"}
+    page = [{"objectid": 1, "geometry": {"x": 6.1, "y": 46.2}}]
+
+    pipeline.upsert_page(state, ds, page)
+    state["geom_ewkb"] = True
+    pipeline.upsert_page(state, ds, page)
+
+    assert posted[0]["geometry"] == '{"x":6.1,"y":46.2}'
+    assert posted[1]["geometry"].startswith("0101000020e6100000")
+    assert page[0]["geometry"] == {"x": 6.1, "y": 46.2}  # shared page untouched
@@ -0,0 +1,48 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+PIPELINE = Path(__file__).parents[1] / "pipelines" / "zefix" / "import.py"
+
+
+@pytest.fixture(scope="module")
+def zefix():
+    spec = importlib.util.spec_from_file_location("zefix_import", PIPELINE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def row(uid, canton, name="x"):
+    return {"uid": f"CHE-{uid}", "uid_raw": uid, "name": name, "canton": canton}
+
+
+def test_last_row_wins_within_chunk(zefix):
+    chunk = [row(1, "GE", "old"), row(2, "GE"), row(1, "GE", "new")]
+    unique, uids, superseded = zefix.dedupe_uids(chunk, 0, {})
+    assert [r["name"] for r in unique] == ["new", "x"]
+    assert set(uids) == {1, 2}
+    assert not superseded
+
+
+@pytest.mark.parametrize("first", ["GE", "VD"])
+def test_later_canton_wins_whatever_arrives_first(zefix, first):
+    rank = {"GE": 0, "VD": 1}
+    chunks = {"GE": [row(1, "GE")], "VD": [row(1, "VD")]}
+    owners = {}
+    written = {}
+    for canton in (first, "VD" if first == "GE" else "GE"):
+        unique, uids, _ = zefix.dedupe_uids(chunks[canton], rank[canton], owners)
+        for r in unique:
+            written[r["uid_raw"]] = r["canton"]
+        for uid in uids:
+            owners[uid] = (rank[canton], canton)
+    assert written == {1: "VD"}
+
+
+def test_rows_without_uid_are_kept(zefix):
+    chunk = [{"uid": None, "uid_raw": None, "name": "a"}] * 2
+    unique, uids, _ = zefix.dedupe_uids(chunk, 0, {})
+    assert len(unique) == 2
+    assert not uids